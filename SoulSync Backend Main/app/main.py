@@ -13,8 +13,12 @@ from fastapi.responses import JSONResponse
 from app.models.book import Book
 from app.models.media_item import FeatureWeights, MediaItem
 from app.models.movie import Movie
+from app.models.popularity import Popularity
 from app.models.preference import Preference
+from app.models.recommendation_cache import RecommendationCache
+from app.models.recommendation_feed import RecommendationFeed
 from app.models.user import User
+from app.models.user_profile import UserProfile
 from app.router.book import router as book_router
 from app.router.media_item import router as media_items_router
 from app.router.movie import router as movie_router
@@ -33,6 +37,17 @@ if connection_string is None:
 database = os.getenv("MONGODB_DATABASE", "")
 if database == "":
     raise ValueError("MONGODB_DATABASE is required")
+vector_dir = os.getenv("VECTOR_DIR", "vectors")
+# Outside development the artifact is built offline with `make vectors`
+vector_serving_only = (
+    os.getenv(
+        "VECTOR_SERVING_ONLY", "false" if env == "development" else "true"
+    ).lower()
+    == "true"
+)
+# Shared by the sync client of background jobs and the async request client
+mongodb_max_pool_size = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+mongodb_min_pool_size = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
 
 version = "0.0.1"
 root_path = "/api/v1"
@@ -45,16 +60,42 @@ unauthorized_paths = [
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    client: pymongo.MongoClient = pymongo.MongoClient(connection_string)
+    client: pymongo.MongoClient = pymongo.MongoClient(
+        connection_string,
+        maxPoolSize=mongodb_max_pool_size,
+        minPoolSize=mongodb_min_pool_size,
+    )
+    async_client: pymongo.AsyncMongoClient = pymongo.AsyncMongoClient(
+        connection_string,
+        maxPoolSize=mongodb_max_pool_size,
+        minPoolSize=mongodb_min_pool_size,
+    )
     db = client[database]
-    User.getInstance().init(db)
-    MediaItem.getInstance().init(db, "vectors/item_vectors.joblib", FeatureWeights())
-    Book.getInstance().init(db)
-    Movie.getInstance().init(db)
-    Preference.getInstance().init(db)
+    async_db = async_client[database]
+    User.getInstance().init(db, async_db)
+    User.getInstance().start_hashing()
+    MediaItem.getInstance().init(
+        db,
+        vector_dir,
+        FeatureWeights(),
+        serving_only=vector_serving_only,
+        background=True,
+        async_db=async_db,
+    )
+    MediaItem.getInstance().start_scoring()
+    Book.getInstance().init(db, async_db)
+    Movie.getInstance().init(db, async_db)
+    Preference.getInstance().init(db, async_db)
+    Popularity.getInstance().init(db, background=True)
+    RecommendationFeed.getInstance().init(db, async_db)
+    UserProfile.getInstance().init(db)
+    RecommendationCache.getInstance().init()
     gc.collect()
     logger.info("---Initialised application---")
     yield
+    MediaItem.getInstance().stop_scoring()
+    User.getInstance().stop_hashing()
+    await async_client.close()
     client.close()
     logger.info("---Shutting down---")
 
@@ -77,8 +118,9 @@ async def authenticate(request: Request, call_next):
             and request.url.path not in unauthorized_paths
             and request.method != "OPTIONS"
         ):
-            # Call the verify_access_token function to validate the token
-            verify_access_token(request)
+            # Validate the token once; handlers read the claims through the
+            # get_current_user dependency
+            request.state.user = verify_access_token(request)
         # If token validation succeeds, continue to the next middleware or route handler
         response = await call_next(request)
         return response
@@ -98,6 +140,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers only let scripts read response headers listed here
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -2,9 +2,13 @@ from datetime import datetime
 from typing import Any, Self
 
 from pydantic import BaseModel, Field
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.collection import Collection
 from pymongo.database import Database
 
+from app.utils.document_cache import DocumentCache
+
 
 class BookModel(BaseModel):
     id: str = Field(..., alias="_id")
@@ -31,19 +35,32 @@ class Book:
             cls._instance = Book()
         return cls._instance
 
-    def init(self, db: Database):
+    def init(self, db: Database, async_db: AsyncDatabase | None = None):
         self.db = db
         self.collection: Collection[dict[str, Any]] = db.get_collection("books")
+        self.cache: DocumentCache[BookModel] = DocumentCache("book", BookModel)
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("books")
+            )
+
+    async def get_by_ids_async(self, ids: list[str]) -> dict[str, BookModel]:
+        return await self.cache.get_many_async(ids, self._load_many_async)
 
-    def get_by_id(self, id: str):
-        book = self.collection.find_one({"_id": id})
-        return BookModel(**book) if book is not None else None
+    async def _load_many_async(self, ids: list[str]) -> dict[str, BookModel]:
+        books = self.async_collection.find({"_id": {"$in": ids}})
+        return {book["_id"]: BookModel(**book) async for book in books}
 
-    def create(self, book: BookModel):
-        self.collection.insert_one(book.model_dump(by_alias=True))
+    async def create_async(self, book: BookModel):
+        await self.async_collection.insert_one(book.model_dump(by_alias=True))
+        await self.cache.invalidate_async(book.id)
 
-    def update(self, book: BookModel):
-        self.collection.replace_one({"_id": book.id}, book.model_dump(by_alias=True))
+    async def update_async(self, book: BookModel):
+        await self.async_collection.replace_one(
+            {"_id": book.id}, book.model_dump(by_alias=True)
+        )
+        await self.cache.invalidate_async(book.id)
 
-    def delete(self, id: str):
-        self.collection.delete_one({"_id": id})
+    async def delete_async(self, id: str):
+        await self.async_collection.delete_one({"_id": id})
+        await self.cache.invalidate_async(id)
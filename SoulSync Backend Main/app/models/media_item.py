@@ -1,26 +1,86 @@
-import heapq
+import fcntl
+import json
 import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Any, Self
 
-import joblib
 import numpy as np
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Collection, Database
-from scipy import sparse
-from scipy.sparse import csr_matrix
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.random_projection import GaussianRandomProjection
+from threadpoolctl import threadpool_limits
 
-from app.models.preference import PreferenceModel, PreferenceType
+from app.models.popularity import Popularity
+from app.models.preference import (Preference, PreferenceChange,
+                                   PreferenceModel, PreferenceType)
+from app.utils.executor import BoundedExecutor
 from app.utils.logging import log as logger
+from app.utils.prefix_index import PrefixIndex
+from app.vectors.artifact import (VectorArtifact, artifact_lock, load_artifact,
+                                  read_manifest, save_artifact)
+from app.vectors.blocks import BLOCKS_DIR, FeatureBlocks
+from app.vectors.build import (ARTIFACT_DIR, CATCH_UP_MARGIN, build_vectors,
+                               is_artifact_stale)
+from app.vectors.cf import CF_DIR, CFModel
+from app.vectors.encoder import ItemEncoder
+from app.vectors.neighbours import NEIGHBOURS_DIR, NeighbourTable
+from app.vectors.profiles import DISLIKE, LIKE, ProfileVectors
+from app.vectors.query import QueryEncoder
+from app.vectors.scoring import top_k
+from app.vectors.store import VectorStore
 
-# Initialize this once, outside the function
 n_components = 200  # Adjust based on desired accuracy vs. speed trade-off
-random_projection = GaussianRandomProjection(n_components=n_components)
+# Fixed seed so every worker and every restart projects into the same space
+random_seed = int(os.getenv("VECTOR_SEED", "42"))
+scoring_threads = int(os.getenv("SCORING_THREADS", "1"))
+# Workers of the executor /recommend and /similar score on, the calls that may
+# wait for one before new ones are refused, and the BLAS threads each uses
+recommend_workers = int(
+    os.getenv(
+        "RECOMMEND_WORKERS", str(max(1, (os.cpu_count() or 1) // scoring_threads))
+    )
+)
+recommend_max_queue = int(os.getenv("RECOMMEND_MAX_QUEUE", "64"))
+recommend_blas_threads = int(os.getenv("RECOMMEND_BLAS_THREADS", "1"))
+# Share of tombstoned rows after which the artifact is rewritten
+compaction_threshold = float(os.getenv("VECTOR_COMPACTION_THRESHOLD", "0.1"))
+# Writes live only in the delta of the worker that made them until they are
+# compacted into the artifact, which every worker then reloads; these bound
+# how many and for how long
+compaction_max_writes = int(os.getenv("VECTOR_COMPACTION_MAX_WRITES", "1000"))
+compaction_max_age = int(os.getenv("VECTOR_COMPACTION_MAX_AGE_SECONDS", "300"))
+# Deployment default for /recommend; requests can override both
+default_search = os.getenv("RECOMMEND_SEARCH", "exact")
+ann_nprobe = int(os.getenv("ANN_NPROBE", "8"))
+# float16 or int8 copy of the vectors for the coarse pass of exact search,
+# and how many of its best rows are rescored on the full precision matrix
+vector_quantization = os.getenv("VECTOR_QUANTIZATION") or None
+quantized_rerank = int(os.getenv("VECTOR_QUANTIZED_RERANK", "200"))
+# Share of the collaborative filtering score in blended recommendations
+default_cf_weight = float(os.getenv("RECOMMEND_CF_WEIGHT", "0.3"))
+# Scheduled refits of the whole artifact; 0 disables them
+rebuild_interval = int(os.getenv("VECTOR_REBUILD_INTERVAL_SECONDS", "0"))
+# How often workers look for an artifact written by another process
+reload_interval = int(os.getenv("VECTOR_RELOAD_INTERVAL_SECONDS", "60"))
+# Named FeatureWeights /recommend can ask for, as JSON, e.g.
+# {"plot": {"description": 0.7, "genres": 0.3}}; features left out weigh 0
+weight_presets = os.getenv("WEIGHT_PRESETS", "{}")
+# Deployment default for /search, and the share of the Mongo text score when
+# hybrid search reranks vector candidates
+default_text_search = os.getenv("SEARCH_MODE", "text")
+hybrid_text_weight = float(os.getenv("SEARCH_HYBRID_TEXT_WEIGHT", "0.5"))
+REBUILD_LOCK_FILE = ".rebuild.lock"
+TYPEAHEAD_FIELDS = {"title": 1, "creator": 1, "type": 1, "rating": 1}
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
 
 class MediaItemType(str, Enum):
@@ -29,6 +89,17 @@ class MediaItemType(str, Enum):
     all = "all"
 
 
+class SearchMode(str, Enum):
+    exact = "exact"
+    ann = "ann"
+
+
+class TextSearchMode(str, Enum):
+    text = "text"
+    vector = "vector"
+    hybrid = "hybrid"
+
+
 class MediaItemModel(BaseModel):
     id: str = Field(..., alias="_id")
     type: MediaItemType
@@ -59,6 +130,14 @@ class FeatureWeights:
     def to_dict(self) -> dict[str, float]:
         return self.__dict__
 
+    @classmethod
+    def from_dict(cls, weights: dict[str, float]) -> "FeatureWeights":
+        fields = list(cls.__dataclass_fields__)
+        unknown = set(weights) - set(fields)
+        if unknown:
+            raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+        return cls(**{field: float(weights.get(field, 0.0)) for field in fields})
+
 
 class MediaItem:
     _instance: Self | None = None
@@ -72,160 +151,451 @@ class MediaItem:
     def init(
         self,
         db: Database,
-        vector_filename: str,
+        vector_dir: str,
         weights: FeatureWeights,
         force_compute_weights=False,
+        serving_only=False,
+        background=False,
+        async_db: AsyncDatabase | None = None,
+        scoring_only=False,
     ):
         self.db = db
         self.collection: Collection[dict[str, Any]] = db.get_collection("mediaItems")
-        # Ensure text index is created for relevant fields
-        self.collection.create_index(
-            [("title", "text"), ("creator", "text"), ("description", "text")]
-        )
-        self.collection.create_index([("type", 1)])
-        self.vector_filename = vector_filename
-        self.item_vectors: dict = {}
-        self.item_ids: list[str] = []
-        self.date_scaler = MinMaxScaler()
-        self.runtime_scaler = MinMaxScaler()
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("mediaItems")
+            )
+        # Offline jobs that only score profiles, such as build_feeds, load the
+        # vectors and CF and skip the indexes, typeahead and write listeners
+        self.scoring_only = scoring_only
+        if not scoring_only:
+            # Ensure text index is created for relevant fields
+            self.collection.create_index(
+                [("title", "text"), ("creator", "text"), ("description", "text")]
+            )
+            self.collection.create_index([("type", 1)])
+            # Builds re-read the items written while they ran
+            self.collection.create_index([("updated_at", 1)])
+        self.vector_dir = vector_dir
+        self.artifact_path = os.path.join(vector_dir, ARTIFACT_DIR)
         self.weights = weights
-        self.feature_sizes: dict = {}
-        self.reduced_vectors: np.ndarray = None
-        self.item_id_to_index: dict[str, int] = {}
-        if not os.path.exists(vector_filename) or force_compute_weights:
-            self._precompute_vectors()
-            self._load_vectors()
+        self.weight_presets: dict[str, FeatureWeights] = {"default": weights}
+        for name, preset in json.loads(weight_presets).items():
+            self.weight_presets[name] = FeatureWeights.from_dict(preset)
+        self.artifact: VectorArtifact = None
+        self.store: VectorStore = None
+        self.neighbours: NeighbourTable | None = None
+        self.blocks: FeatureBlocks | None = None
+        self._encoder: ItemEncoder | None = None
+        self._query_encoder: QueryEncoder | None = None
+        self._compaction: threading.Thread | None = None
+        self._rebuild: threading.Thread | None = None
+        self.rebuild_status: dict[str, Any] = {"running": False}
+        self._write_lock = threading.Lock()
+        # Items written since are re-read when another artifact is loaded
+        self._typeahead_synced_at: datetime | None = None
+        self.scoring: BoundedExecutor | None = None
+        os.makedirs(vector_dir, exist_ok=True)
+        if serving_only:
+            # Serving workers only map the artifact; it is built offline with
+            # scripts/build_vectors.py, so workers never race each other
+            logger.debug("Serving only, skipping vectors calculations")
+        elif force_compute_weights or is_artifact_stale(
+            vector_dir, weights.to_dict(), n_components, random_seed
+        ):
+            build_vectors(
+                self.collection,
+                vector_dir,
+                weights.to_dict(),
+                n_components,
+                random_seed,
+                reuse_features=not force_compute_weights,
+                quantization=vector_quantization,
+            )
         else:
             logger.debug("Skipping vectors calculations")
-            self._load_vectors()
+        self._load_vectors()
+        self.typeahead = PrefixIndex()
+        if not scoring_only:
+            self._build_typeahead()
+        # Built offline with scripts/build_cf.py; content only without it
+        self.cf = CFModel.load(os.path.join(vector_dir, CF_DIR))
+        if not scoring_only:
+            Preference.getInstance().add_listener(self._on_preferences)
+        if background:
+            threading.Thread(
+                target=self._watch, name="vector-watcher", daemon=True
+            ).start()
+
+    def start_scoring(
+        self,
+        workers: int = recommend_workers,
+        max_queue: int = recommend_max_queue,
+        blas_threads: int = recommend_blas_threads,
+    ):
+        # Only the API process pins BLAS; offline jobs such as build_feeds
+        # multiply whole matrices and want every core for one product. The
+        # limit is process wide, and workers x BLAS threads is what keeps
+        # concurrent requests from oversubscribing the cores.
+        threadpool_limits(limits=blas_threads, user_api="blas")
+        self.scoring = BoundedExecutor(
+            "scoring",
+            ThreadPoolExecutor(workers, thread_name_prefix="recommend"),
+            workers,
+            max_queue,
+        )
 
-    def create(self, item: MediaItemModel):
-        self.collection.insert_one(item.model_dump(by_alias=True))
+    def stop_scoring(self):
+        if self.scoring is not None:
+            self.scoring.shutdown()
+            self.scoring = None
 
-    def update(self, item: MediaItemModel):
-        self.collection.update_one(
-            {"_id": item.id}, {"$set": item.model_dump(by_alias=True)}
-        )
+    async def _score(self, fn, *args):
+        if self.scoring is None:
+            return await run_in_threadpool(fn, *args)
+        return await self.scoring.run(fn, *args)
 
-    def delete(self, id: str):
-        self.collection.delete_one({"_id": id})
+    async def create_async(self, item: MediaItemModel):
+        await self.async_collection.insert_one(
+            {**item.model_dump(by_alias=True), "updated_at": datetime.now(timezone.utc)}
+        )
+        await run_in_threadpool(self._index_written, item)
+
+    async def update_async(self, item: MediaItemModel):
+        await self.async_collection.update_one(
+            {"_id": item.id},
+            {
+                "$set": {
+                    **item.model_dump(by_alias=True),
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            },
+        )
+        await run_in_threadpool(self._index_written, item)
+
+    async def delete_async(self, id: str):
+        await self.async_collection.delete_one({"_id": id})
+        # _write_lock is held across Mongo reads by reload and compaction
+        await run_in_threadpool(self._unindex, id)
+
+    def _index_written(self, item: MediaItemModel):
+        # Encoding is CPU bound, so async writers run it in the threadpool
+        self._index_item(item)
+        self.typeahead.add(item.model_dump(by_alias=True, mode="json"))
+
+    def _unindex(self, id: str):
+        self.typeahead.remove(id)
+        with self._write_lock:
+            removed = self.store.remove(id)
+        if removed:
+            self._maybe_compact()
+
+    def _build_typeahead(self):
+        start = time.perf_counter()
+        self._typeahead_synced_at = datetime.now(timezone.utc)
+        self.typeahead.build(
+            self.collection.find({}, TYPEAHEAD_FIELDS).batch_size(10_000)
+        )
+        logger.info(
+            f"Built typeahead index of {len(self.typeahead)} items in {time.perf_counter() - start:.1f}s"
+        )
 
-    def _precompute_vectors(self, batch_size=10000):
-        total_items = self.collection.count_documents({})
-        feature_texts = {
-            feature: [] for feature in ["title", "description", "creator", "genres"]
-        }
+    def _sync_typeahead(self, old_store: VectorStore):
+        # Other workers' writes reach this one with a new artifact. Items it
+        # no longer has are removed, and those written since the last sync
+        # are re-read through the updated_at index, so the catalog is never
+        # scanned again.
+        if self._typeahead_synced_at is None:
+            return
+        synced_at = datetime.now(timezone.utc)
+        for item_id in old_store.id_to_row.keys() - self.store.id_to_row.keys():
+            self.typeahead.remove(item_id)
+        for document in self.collection.find(
+            {"updated_at": {"$gte": self._typeahead_synced_at - CATCH_UP_MARGIN}},
+            TYPEAHEAD_FIELDS,
+        ):
+            self.typeahead.add(document)
+        self._typeahead_synced_at = synced_at
+
+    def _get_encoder(self) -> ItemEncoder:
+        if self._encoder is None:
+            self._encoder = self.artifact.load_encoder()
+        return self._encoder
+
+    def _get_query_encoder(self) -> QueryEncoder:
+        if self._query_encoder is None:
+            self._query_encoder = QueryEncoder(self._get_encoder())
+        return self._query_encoder
+
+    def _index_item(self, item: MediaItemModel):
+        vector = self._get_encoder().encode([item.model_dump()])[0]
+        with self._write_lock:
+            self.store.upsert(item.id, item.type.value, vector)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        store = self.store
+        if not store.log:
+            return
+        if (
+            store.tombstone_ratio < compaction_threshold
+            and len(store.log) < compaction_max_writes
+            and store.pending_age < compaction_max_age
+        ):
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(
+            target=self._compact, name="vector-compaction", daemon=True
+        )
+        self._compaction.start()
+
+    def _compact(self):
+        try:
+            start = time.perf_counter()
+            store = self.store
+            applied = len(store.log)
+            # Other workers may have compacted since this one loaded, so the
+            # writes are replayed onto whatever artifact is newest on disk
+            with artifact_lock(self.vector_dir):
+                latest = load_artifact(self.artifact_path)
+                refitted = latest.manifest.get(
+                    "fitted_at"
+                ) != self.artifact.manifest.get("fitted_at")
+                if not refitted:
+                    merged = VectorStore(
+                        latest.reduced_vectors, latest.item_ids, latest.item_types
+                    )
+                    merged.replay(store.log[:applied])
+                    vectors, item_ids, item_types = merged.materialize()
+                    save_artifact(
+                        self.artifact_path,
+                        vectors,
+                        item_ids,
+                        item_types,
+                        self._get_encoder(),
+                        ann_centroids=(
+                            None if latest.ann is None else latest.ann.centroids
+                        ),
+                        ann_nprobe=ann_nprobe,
+                        fitted_at=latest.manifest.get("fitted_at"),
+                        build_seconds=time.perf_counter() - start,
+                        quantization=(
+                            None if latest.quantized is None else latest.quantized.mode
+                        ),
+                        quantized_rerank=quantized_rerank,
+                    )
+            if refitted:
+                # A rebuild refitted the encoder, so the logged vectors are in
+                # the old space; pick the new artifact up instead
+                self.reload()
+                return
+            with self._write_lock:
+                self._load_vectors()
+                # Writes that landed while compacting are not in the new artifact
+                self.store.replay(store.log[applied:])
+            self._sync_typeahead(store)
+            logger.info(
+                f"Compacted vector artifact to {len(item_ids)} items, replayed {len(self.store.log)} writes"
+            )
+        except Exception as e:
+            logger.error(f"Error compacting vectors: {e}")
 
-        dates = []
-        self.item_ids = []
-        runtimes = []
+    def _load_vectors(self) -> None:
+        artifact = load_artifact(self.artifact_path, ann_nprobe=ann_nprobe)
+        if artifact.manifest["weights"] != self.weights.to_dict():
+            logger.warning(
+                f"Vector artifact was built with weights {artifact.manifest['weights']}"
+            )
+        store = VectorStore(
+            artifact.reduced_vectors,
+            artifact.item_ids,
+            artifact.item_types,
+            n_threads=scoring_threads,
+            ann=artifact.ann,
+            quantized=artifact.quantized,
+            rerank=quantized_rerank,
+        )
+        if artifact.quantized is not None:
+            logger.info(
+                f"Scoring on {artifact.quantized.mode} vectors, {artifact.quantized.nbytes / 2**20:.1f}MB instead of {artifact.reduced_vectors.nbytes / 2**20:.1f}MB"
+            )
+        if artifact.ann is not None:
+            logger.info(
+                f"Loaded ANN index with {artifact.ann.n_lists} lists, manifest recall@10 {artifact.manifest['ann']['recall_at_10']:.3f}"
+            )
+        neighbours = blocks = None
+        if not self.scoring_only:
+            # Built offline with scripts/build_neighbours.py; optional
+            neighbours = NeighbourTable.load(
+                os.path.join(self.vector_dir, NEIGHBOURS_DIR)
+            )
+            # Built with scripts/build_vectors.py --feature-blocks; optional
+            blocks = FeatureBlocks.load(os.path.join(self.vector_dir, BLOCKS_DIR))
+        if blocks is not None and blocks.manifest.get(
+            "fitted_at"
+        ) != artifact.manifest.get("fitted_at"):
+            logger.warning("Feature blocks were built for another fit, ignoring them")
+            blocks = None
+        if neighbours is not None and neighbours.manifest.get(
+            "fitted_at"
+        ) != artifact.manifest.get("fitted_at"):
+            logger.warning("Neighbours were built for another fit, ignoring them")
+            neighbours = None
+        # Everything is prepared before being swapped in one reference at a
+        # time; in-flight requests keep scoring the store they started with,
+        # whose version of the files stays on disk after a newer is published
+        self.store = store
+        self.neighbours = neighbours
+        self.blocks = blocks
+        self.artifact = artifact
+        self._encoder = None
+        self._query_encoder = None
+
+    def reload(self):
+        # Swaps in the artifact on disk and re-applies this worker's writes
+        # since it loaded, re-encoded if the artifact was refitted
+        with self._write_lock:
+            old_store = self.store
+            old_fitted_at = self.artifact.manifest.get("fitted_at")
+            self._load_vectors()
+            if self.artifact.manifest.get("fitted_at") == old_fitted_at:
+                self.store.replay(old_store.log)
+            else:
+                self._replay_encoded(old_store.log)
+        self._sync_typeahead(old_store)
+        logger.info(
+            f"Loaded vector artifact {self.artifact.manifest['created_at']} with {len(self.store)} items"
+        )
 
-        for i in range(0, total_items, batch_size):
-            batch = (
-                self.collection.find(
-                    {},
-                )
-                .skip(i)
-                .limit(batch_size)
+    def _replay_encoded(self, log: list[tuple[str, str, str | None, Any]]):
+        upserted = {item_id for op, item_id, _, _ in log if op == "upsert"}
+        items = [
+            MediaItemModel(**result)
+            for result in self.collection.find({"_id": {"$in": list(upserted)}})
+        ]
+        vectors = dict(
+            zip(
+                [item.id for item in items],
+                (
+                    self._get_encoder().encode([item.model_dump() for item in items])
+                    if items
+                    else []
+                ),
             )
-            try:
-                batch_media_items = [MediaItemModel(**item) for item in batch]
-                self.item_ids.extend([item.id for item in batch_media_items])
-                feature_texts["title"].extend(
-                    [item.title for item in batch_media_items]
-                )
-                feature_texts["description"].extend(
-                    [item.description for item in batch_media_items]
-                )
-                feature_texts["creator"].extend(
-                    [item.creator for item in batch_media_items]
-                )
-                feature_texts["genres"].extend(
-                    " ".join(item.genres) for item in batch_media_items
-                )
-                dates.extend(
-                    [
-                        (
-                            np.nan
-                            if item.release_date is None
-                            else item.release_date.timestamp()
-                        )
-                        for item in batch_media_items
-                    ]
-                )
-                runtimes.extend(
-                    [
-                        np.nan if item.pages_runtime is None else item.pages_runtime
-                        for item in batch_media_items
-                    ]
-                )
-            except Exception as e:
-                logger.error(f"Error processing batch {i}: {e}")
-                raise e
-        logger.debug("Aggregated data from MongoDB")
-        self.item_vectors = {}
-        self.feature_sizes = {}
-        for feature, texts in feature_texts.items():
-            vectorizer = TfidfVectorizer(stop_words="english")
-            self.item_vectors[feature] = vectorizer.fit_transform(texts)
-            self.feature_sizes[feature] = self.item_vectors[feature].shape[1]
-
-        dates_array = np.array(dates).reshape(-1, 1)
-        date_mask = ~np.isnan(dates_array.flatten())
-        self.date_scaler.fit(dates_array[date_mask])
-
-        normalized_dates = np.zeros(dates_array.shape)
-        normalized_dates[date_mask] = self.date_scaler.transform(dates_array[date_mask])
-        self.item_vectors["release_date"] = normalized_dates
-        self.feature_sizes["release_date"] = 1
-
-        runtimes_array = np.array(runtimes).reshape(-1, 1)
-        runtime_mask = ~np.isnan(runtimes_array.flatten())
-        self.runtime_scaler.fit(runtimes_array[runtime_mask])
-        normalized_runtimes = np.zeros(runtimes_array.shape)
-        normalized_runtimes[runtime_mask] = self.runtime_scaler.transform(
-            runtimes_array[runtime_mask]
         )
-        self.item_vectors["pages_runtime"] = normalized_runtimes
-        self.feature_sizes["pages_runtime"] = 1
-
-        joblib.dump(
-            (
-                self.item_vectors,
-                self.item_ids,
-                self.date_scaler,
-                self.runtime_scaler,
-                self.feature_sizes,
-            ),
-            self.vector_filename,
+        for op, item_id, item_type, _ in log:
+            if op != "upsert":
+                self.store.remove(item_id)
+            elif item_id in vectors:
+                self.store.upsert(item_id, item_type, vectors[item_id])
+
+    def rebuild(self) -> bool:
+        if self._rebuild is not None and self._rebuild.is_alive():
+            return False
+        self._rebuild = threading.Thread(
+            target=self._run_rebuild, name="vector-rebuild", daemon=True
         )
-        logger.info(f"Vectors computed and saved to {self.vector_filename}")
+        self._rebuild.start()
+        return True
 
-    def _load_vectors(self) -> None:
-        (
-            self.item_vectors,
-            self.item_ids,
-            self.date_scaler,
-            self.runtime_scaler,
-            self.feature_sizes,
-        ) = joblib.load(self.vector_filename)
-        weighted_vectors = self._get_weighted_vectors()
-        self.reduced_vectors = random_projection.fit_transform(weighted_vectors)
-        self.item_id_to_index = {
-            item_id: index for index, item_id in enumerate(self.item_ids)
-        }
+    def _run_rebuild(self):
+        # The refit runs in its own process, so serving threads never compete
+        # with it for the GIL; only one process rebuilds a vector dir at a time
+        with open(os.path.join(self.vector_dir, REBUILD_LOCK_FILE), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Vector rebuild already running in another process")
+                return
+            started_at = datetime.now(timezone.utc)
+            self.rebuild_status = {"running": True, "started_at": started_at}
+            command = [
+                sys.executable,
+                "-m",
+                "scripts.build_vectors",
+                "--refit",
+                "--vector-dir",
+                os.path.abspath(self.vector_dir),
+            ]
+            if self.store.ann is not None:
+                command += ["--ann-lists", str(self.store.ann.n_lists)]
+            if self.blocks is not None:
+                command.append("--feature-blocks")
+            if self.artifact.quantized is not None:
+                command += ["--quantize", self.artifact.quantized.mode]
+            start = time.perf_counter()
+            try:
+                subprocess.run(command, check=True, cwd=PROJECT_DIR)
+                self.reload()
+                error = None
+            except Exception as e:
+                logger.error(f"Error rebuilding vectors: {e}")
+                error = str(e)
+            self.rebuild_status = {
+                "running": False,
+                "started_at": started_at,
+                "duration_seconds": round(time.perf_counter() - start, 3),
+                "error": error,
+            }
 
-    def _get_weighted_vectors(self) -> csr_matrix:
-        weighted_vectors = []
-        for feature, weight in self.weights.to_dict().items():
-            if feature in self.item_vectors:
-                feature_vector = self.item_vectors[feature]
-                if not sparse.issparse(feature_vector):
-                    feature_vector = csr_matrix(feature_vector)
-                weighted_vectors.append(feature_vector * weight)
-        return sparse.hstack(weighted_vectors)
+    def _watch(self):
+        while True:
+            time.sleep(reload_interval)
+            try:
+                manifest = read_manifest(self.artifact_path)
+                if manifest is None:
+                    continue
+                if manifest["created_at"] != self.artifact.manifest[
+                    "created_at"
+                ] and not (self._compaction and self._compaction.is_alive()):
+                    self.reload()
+                # Every worker runs this check; the age of the fit on disk
+                # keeps them from refitting one after another
+                fitted_at = datetime.fromisoformat(
+                    manifest.get("fitted_at", manifest["created_at"])
+                )
+                if (
+                    rebuild_interval > 0
+                    and (datetime.now(timezone.utc) - fitted_at).total_seconds()
+                    >= rebuild_interval
+                ):
+                    self.rebuild()
+                # Publishes writes that are old enough even when no new
+                # write comes along to trigger it
+                self._maybe_compact()
+            except Exception as e:
+                logger.error(f"Error watching vector artifact: {e}")
+
+    def vector_status(self) -> dict[str, Any]:
+        manifest = self.artifact.manifest
+        return {
+            "artifact": {
+                "created_at": manifest["created_at"],
+                "version": manifest["version"],
+                "n_items": manifest["n_items"],
+                "build_seconds": manifest.get("build_seconds"),
+                "ann": manifest.get("ann"),
+                "quantization": manifest.get("quantization"),
+            },
+            "feature_blocks": None if self.blocks is None else self.blocks.manifest,
+            "store": {
+                "items": self.store.n_alive,
+                "pending_writes": len(self.store.log),
+                "pending_seconds": round(self.store.pending_age, 3),
+                "tombstone_ratio": self.store.tombstone_ratio,
+            },
+            "rebuild": self.rebuild_status,
+        }
 
     def get_popular_items(self, n: int, filter: MediaItemType) -> list[dict[str, Any]]:
+        popular = Popularity.getInstance().get(filter.value, n)
+        if popular is not None:
+            # Skips items deleted since the last refresh
+            return [
+                item for item in popular if self.store.row_of(item["_id"]) is not None
+            ]
+        # Before the first refresh, or deeper than the ranking goes
         query = {} if filter == MediaItemType.all else {"type": filter}
         results = (
             self.collection.find(query, {"_id": 1, "type": 1})
@@ -234,127 +604,405 @@ class MediaItem:
         )
         return list(results)
 
-    def search(self, filter_type: MediaItemType, search: str, limit: int):
-        # Base query
-        query: dict[str, Any] = {"$text": {"$search": search}}
+    def vector_search(
+        self,
+        filter_type: MediaItemType,
+        search: str,
+        limit: int,
+        rerank: bool = False,
+        n_candidates: int = 100,
+    ) -> list[dict[str, Any]] | None:
+        # With rerank, returns up to n_candidates for _text_rerank_async
+        query = self._get_query_encoder().encode(search)
+        if query is None:
+            return None
+        item_type = None if filter_type == MediaItemType.all else filter_type.value
+        rows, scores = self.store.top_k(
+            query, max(limit, n_candidates) if rerank else limit, item_type=item_type
+        )
+        return [
+            {**item, "score": float(score)}
+            for item, score in zip(self._to_items(rows), scores)
+        ]
+
+    async def _text_rerank_async(
+        self, search: str, results: list[dict[str, Any]], limit: int
+    ) -> list[dict[str, Any]]:
+        # Blends in the Mongo text score of the same candidates, normalised
+        # to the best one so both parts are on a 0-1 scale
+        cursor = self.async_collection.find(
+            {
+                "$text": {"$search": search},
+                "_id": {"$in": [result["_id"] for result in results]},
+            },
+            {"_id": 1, "score": {"$meta": "textScore"}},
+        )
+        text_scores = {result["_id"]: result["score"] async for result in cursor}
+        best_text = max(text_scores.values(), default=0) or 1
+        for result in results:
+            result["score"] += (
+                hybrid_text_weight * text_scores.get(result["_id"], 0) / best_text
+            )
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:limit]
 
-        # Add type filter if not "all"
+    async def search_async(
+        self,
+        filter_type: MediaItemType,
+        search: str,
+        limit: int,
+        mode: TextSearchMode | None = None,
+    ):
+        mode = mode or TextSearchMode(default_text_search)
+        if mode != TextSearchMode.text:
+            # Scored on the bounded pool like recommendations; the text
+            # rerank reads Mongo on the event loop instead of holding a worker
+            rerank = mode == TextSearchMode.hybrid
+            results = await self._score(
+                self.vector_search, filter_type, search, limit, rerank
+            )
+            if results is not None:
+                if rerank and results:
+                    return await self._text_rerank_async(search, results, limit)
+                return results
+        return await self.text_search_async(filter_type, search, limit)
+
+    async def text_search_async(
+        self, filter_type: MediaItemType, search: str, limit: int
+    ) -> list[dict[str, Any]]:
+        query: dict[str, Any] = {"$text": {"$search": search}}
         if filter_type != MediaItemType.all:
             query["type"] = filter_type
-
-        # Perform the search
         results = (
-            self.collection.find(
-                query,
-                {
-                    "_id": 1,
-                    "type": 1,
-                    "score": {"$meta": "textScore"},  # Include the text match score
-                },
+            self.async_collection.find(
+                query, {"_id": 1, "type": 1, "score": {"$meta": "textScore"}}
             )
-            .sort([("score", {"$meta": "textScore"})])  # Sort by relevance
+            .sort([("score", {"$meta": "textScore"})])
             .limit(limit)
         )
-        return list(results)
+        return await results.to_list()
+
+    def suggest(
+        self, query: str, limit: int, filter: MediaItemType = MediaItemType.all
+    ) -> list[dict[str, Any]]:
+        item_type = None if filter == MediaItemType.all else filter.value
+        return self.typeahead.search(query, limit, item_type)
+
+    async def validate_media_ids_async(self, media_ids: list[str]) -> set[str]:
+        # The ids among media_ids that exist, in one query
+        results = self.async_collection.find({"_id": {"$in": media_ids}}, {"_id": 1})
+        return {result["_id"] async for result in results}
+
+    async def validate_media_id_async(self, media_id: str) -> bool:
+        return (
+            await self.async_collection.find_one({"_id": media_id}, {"_id": 1})
+            is not None
+        )
 
-    def validate_media_id(self, media_id: str) -> bool:
-        return self.collection.find_one({"_id": media_id}) is not None
+    def build_profile(self, user_preferences: list[PreferenceModel]) -> ProfileVectors:
+        profile = ProfileVectors(self.store.vectors.shape[1])
+        for pref in user_preferences:
+            self.apply_preference(profile, pref.media_item_id, pref.preference)
+        return profile
 
-    def get_recommendations(
-        self,
-        filter: MediaItemType,
-        user_preferences: list[PreferenceModel],
-        n_recommendations: int = 10,
-        diversity_factor: float = 0.2,
+    def apply_preference(
+        self, profile: ProfileVectors, media_item_id: str, preference: PreferenceType
     ):
-        # Filter items by type in the database
-        if filter != MediaItemType.all:
-            filtered_items = list(self.collection.find({"type": filter}, {"_id": 1}))
-            filtered_item_ids = [item["_id"] for item in filtered_items]
-            filtered_indices = [
-                self.item_id_to_index[item_id]
-                for item_id in filtered_item_ids
-                if item_id in self.item_id_to_index
-            ]
-        else:
-            filtered_indices = list(range(len(self.item_ids)))
-            filtered_item_ids = self.item_ids
+        row = self.store.row_of(media_item_id)
+        # Items missing from the store cannot contribute, but take back
+        # whatever they added while they were in it
+        if preference == PreferenceType.nil or row is None:
+            profile.remove(media_item_id)
+            return
+        profile.add(
+            media_item_id,
+            self.store.type_of(row),
+            preference.value,
+            self.store.get_vectors([row])[0],
+        )
 
-        filtered_vectors = self.reduced_vectors[filtered_indices]
+    def _profile_query(
+        self, profile: ProfileVectors, item_type: str | None
+    ) -> tuple[np.ndarray | None, list[int]]:
+        exclude = self.store.rows_of(profile.rated_ids(item_type), item_type)
+        return profile.vector(item_type), exclude
+
+    def _on_preferences(self, changes: list[PreferenceChange]):
+        if self.cf is None:
+            return
+        by_user: dict[str, list[PreferenceChange]] = {}
+        for preference, previous in changes:
+            if (previous == PreferenceType.like) != (
+                preference.preference == PreferenceType.like
+            ):
+                by_user.setdefault(preference.user_id, []).append(
+                    (preference, previous)
+                )
+        for user_id, user_changes in by_user.items():
+            # One read of the likes per user. The batch is rolled back off
+            # them and replayed, so each change pairs with the likes that
+            # stood right after it, as if written one at a time.
+            liked = set(Preference.getInstance().get_liked_ids(user_id))
+            for preference, previous in reversed(user_changes):
+                liked.discard(preference.media_item_id)
+                if previous == PreferenceType.like:
+                    liked.add(preference.media_item_id)
+            for preference, _ in user_changes:
+                is_liked = preference.preference == PreferenceType.like
+                if is_liked:
+                    liked.add(preference.media_item_id)
+                else:
+                    liked.discard(preference.media_item_id)
+                self.cf.update(
+                    preference.media_item_id, list(liked), 1 if is_liked else -1
+                )
 
-        liked_indices = [
-            filtered_item_ids.index(pref.media_item_id)
-            for pref in user_preferences
-            if pref.preference == PreferenceType.like
-            and pref.media_item_id in filtered_item_ids
-        ]
-        disliked_indices = [
-            filtered_item_ids.index(pref.media_item_id)
-            for pref in user_preferences
-            if pref.preference == PreferenceType.dislike
-            and pref.media_item_id in filtered_item_ids
+    def _blend(
+        self,
+        user_profile: np.ndarray | None,
+        profile: ProfileVectors,
+        item_type: str | None,
+        exclude: list[int],
+        content_rows: np.ndarray,
+        n: int,
+        cf_weight: float,
+    ) -> np.ndarray:
+        # CF candidates come from what the user liked in any category, which
+        # is what makes cross-category recommendations possible
+        cf_ids, cf_scores = self.cf.score(
+            profile.rated_ids(preference=PreferenceType.like.value)
+        )
+        rows = np.fromiter(
+            (-1 if row is None else row for row in map(self.store.row_of, cf_ids)),
+            dtype=np.intp,
+            count=len(cf_ids),
+        )
+        keep = rows >= 0
+        keep[keep] = ~np.isin(rows[keep], exclude)
+        if item_type is not None:
+            keep[keep] = self.store.types_of(rows[keep]) == item_type
+        rows, cf_scores = rows[keep], cf_scores[keep]
+        local, cf_scores = top_k(cf_scores, n)
+        cf_rows = rows[local]
+
+        candidates = np.unique(np.concatenate([content_rows, cf_rows]))
+        if len(candidates) == 0:
+            return candidates
+        cf_part = np.zeros(len(candidates))
+        if len(cf_rows) > 0:
+            cf_part[np.searchsorted(candidates, cf_rows)] = cf_scores / cf_scores[0]
+        if user_profile is None:
+            blended = cf_part
+        else:
+            content_part = self.store.get_vectors(
+                candidates
+            ) @ self.store.scoring.normalize_query(user_profile)
+            blended = (1 - cf_weight) * content_part + cf_weight * cf_part
+        best, _ = top_k(blended, n)
+        return candidates[best]
+
+    def _to_items(self, rows: np.ndarray) -> list[dict[str, Any]]:
+        # Types come from the store, so no per result Mongo lookups are needed
+        return [
+            {"_id": self.store.id_of(row), "type": self.store.type_of(row)}
+            for row in rows
         ]
 
-        if not liked_indices:
-            return self.get_popular_items(n_recommendations, filter)
-
-        user_profile = np.mean(filtered_vectors[liked_indices], axis=0)
-        if disliked_indices:
-            user_profile -= 0.5 * np.mean(filtered_vectors[disliked_indices], axis=0)
-
-        def process_batch(start, end):
-            batch = filtered_vectors[start:end]
-            dot_products = np.dot(user_profile, batch.T)
-            batch_similarities = dot_products / (
-                np.linalg.norm(user_profile) * np.linalg.norm(batch, axis=1)
-            )
-            top_indices = np.argpartition(batch_similarities, -2 * n_recommendations)[
-                -2 * n_recommendations :
-            ]
-            return [(start + i, batch_similarities[i]) for i in top_indices]
-
-        batch_size = 10_000
-        top_similarities = []
-        for i in range(0, filtered_vectors.shape[0], batch_size):
-            batch_top = process_batch(i, min(i + batch_size, filtered_vectors.shape[0]))
-            top_similarities.extend(batch_top)
-            top_similarities = heapq.nlargest(
-                2 * n_recommendations, top_similarities, key=lambda x: x[1]
+    def get_batch_recommendations(
+        self,
+        filter: MediaItemType,
+        profiles_by_user: dict[str, ProfileVectors],
+        n_recommendations: int = 10,
+        cf_weight: float = default_cf_weight,
+    ) -> dict[str, list[dict[str, Any]]]:
+        item_type = None if filter == MediaItemType.all else filter.value
+        use_cf = self.cf is not None and cf_weight > 0
+        feeds: dict[str, list[dict[str, Any]]] = {}
+        user_ids: list[str] = []
+        profiles: list[np.ndarray] = []
+        excludes: list[list[int]] = []
+        for user_id, profile in profiles_by_user.items():
+            user_profile, exclude = self._profile_query(profile, item_type)
+            if user_profile is not None:
+                user_ids.append(user_id)
+                profiles.append(user_profile)
+                excludes.append(exclude)
+            elif use_cf:
+                rows = self._blend(
+                    None,
+                    profile,
+                    item_type,
+                    exclude,
+                    np.empty(0, dtype=np.intp),
+                    n_recommendations,
+                    cf_weight,
+                )
+                # Users without any signal are served the popular items instead
+                if len(rows) > 0:
+                    feeds[user_id] = self._to_items(rows)
+        if profiles:
+            results = self.store.top_k_batch(
+                np.stack(profiles), n_recommendations, item_type, excludes
             )
+            for user_id, user_profile, exclude, (rows, _) in zip(
+                user_ids, profiles, excludes, results
+            ):
+                if use_cf:
+                    rows = self._blend(
+                        user_profile,
+                        profiles_by_user[user_id],
+                        item_type,
+                        exclude,
+                        rows,
+                        n_recommendations,
+                        cf_weight,
+                    )
+                feeds[user_id] = self._to_items(rows)
+        return feeds
+
+    def get_similar(
+        self, media_id: str, n: int, filter: MediaItemType = MediaItemType.all
+    ) -> list[dict[str, Any]] | None:
+        item_type = None if filter == MediaItemType.all else filter.value
+        neighbours = (
+            self.neighbours.neighbours(media_id)
+            if self.neighbours is not None
+            else None
+        )
+        if neighbours is not None:
+            results: list[dict[str, Any]] = []
+            for neighbour_id, _ in neighbours:
+                row = self.store.row_of(neighbour_id)
+                # Deleted since the table was built
+                if row is None:
+                    continue
+                if item_type is not None and self.store.type_of(row) != item_type:
+                    continue
+                results.append({"_id": neighbour_id, "type": self.store.type_of(row)})
+                if len(results) == n:
+                    return results
+        # Items newer than the table, or too few neighbours left after
+        # filtering, are scored against the whole store
+        row = self.store.row_of(media_id)
+        if row is None:
+            return None
+        top_rows, _ = self.store.top_k(
+            self.store.get_vectors([row])[0], n, item_type=item_type, exclude=[row]
+        )
+        return self._to_items(top_rows)
 
-        top_indices, similarities = zip(*top_similarities)
-        top_indices = np.array(top_indices)
-        similarities = np.array(similarities)
+    async def get_similar_async(
+        self, media_id: str, n: int, filter: MediaItemType = MediaItemType.all
+    ) -> list[dict[str, Any]] | None:
+        return await self._score(self.get_similar, media_id, n, filter)
 
-        mask = np.isin(top_indices, liked_indices + disliked_indices, invert=True)
-        top_indices = top_indices[mask]
-        similarities = similarities[mask]
+    async def get_candidates_async(
+        self,
+        filter: MediaItemType,
+        profile: ProfileVectors,
+        n_candidates: int,
+        search: SearchMode | None = None,
+        nprobe: int | None = None,
+        cf_weight: float | None = None,
+        weights: FeatureWeights | None = None,
+    ) -> list[dict[str, Any]]:
+        return await self._score(
+            self.get_candidates,
+            filter,
+            profile,
+            n_candidates,
+            search,
+            nprobe,
+            cf_weight,
+            weights,
+        )
 
-        if np.random.random() < diversity_factor:
-            n_top = n_recommendations // 2
-            n_diverse = n_recommendations - n_top
-            top_picks = top_indices[:n_top]
-            diverse_picks = np.random.choice(
-                top_indices[n_top:], size=n_diverse, replace=False
+    def get_candidates(
+        self,
+        filter: MediaItemType,
+        profile: ProfileVectors,
+        n_candidates: int,
+        search: SearchMode | None = None,
+        nprobe: int | None = None,
+        cf_weight: float | None = None,
+        weights: FeatureWeights | None = None,
+    ) -> list[dict[str, Any]]:
+        # Best first, so callers can page it
+        if (
+            weights is not None
+            and weights.to_dict() != self.artifact.manifest["weights"]
+        ):
+            return self._weighted_candidates(filter, profile, n_candidates, weights)
+        search = search or SearchMode(default_search)
+        if search == SearchMode.ann and self.store.ann is None:
+            logger.debug("No ANN index in the vector artifact, using exact search")
+            search = SearchMode.exact
+        cf_weight = default_cf_weight if cf_weight is None else cf_weight
+        use_cf = self.cf is not None and cf_weight > 0
+        item_type = None if filter == MediaItemType.all else filter.value
+        user_profile, exclude = self._profile_query(profile, item_type)
+        if user_profile is None and not use_cf:
+            return self.get_popular_items(n_candidates, filter)
+
+        top_rows = np.empty(0, dtype=np.intp)
+        if user_profile is not None:
+            top_rows, _ = self.store.top_k(
+                user_profile,
+                n_candidates,
+                item_type=item_type,
+                exclude=exclude,
+                nprobe=(nprobe or ann_nprobe) if search == SearchMode.ann else None,
             )
-            selected_indices = np.concatenate([top_picks, diverse_picks])
-            np.random.shuffle(selected_indices)
-        else:
-            selected_indices = top_indices[:n_recommendations]
-
-        recommended_items: list[dict[str, Any]] = []
-        for i in selected_indices:
-            item_id = filtered_item_ids[i]
-            result = {
-                "_id": item_id,
-                "type": (
-                    filter
-                    if filter != MediaItemType.all
-                    else self.collection.find_one({"_id": item_id})["type"]
-                ),
-            }
-            recommended_items.append(result)
-            if len(recommended_items) == n_recommendations:
-                break
+        if use_cf:
+            top_rows = self._blend(
+                user_profile,
+                profile,
+                item_type,
+                exclude,
+                top_rows,
+                n_candidates,
+                cf_weight,
+            )
+        if len(top_rows) == 0:
+            return self.get_popular_items(n_candidates, filter)
+        return self._to_items(top_rows)
 
-        return recommended_items
+    def _weighted_candidates(
+        self,
+        filter: MediaItemType,
+        profile: ProfileVectors,
+        n_candidates: int,
+        weights: FeatureWeights,
+    ) -> list[dict[str, Any]]:
+        # Scored on the per feature blocks, so other weights need neither a
+        # new projection nor re-encoded items. Items written since the build
+        # are missing until the next one, and CF is not blended in.
+        if self.blocks is None:
+            raise ValueError("Custom weights need the feature blocks")
+        blocks = self.blocks
+        weights_dict = weights.to_dict()
+        item_type = None if filter == MediaItemType.all else filter.value
+        liked = blocks.rows_of(profile.rated_ids(item_type, LIKE))
+        if not liked:
+            return self.get_popular_items(n_candidates, filter)
+        query = blocks.vectors(liked, weights_dict).mean(axis=0)
+        disliked = blocks.rows_of(profile.rated_ids(item_type, DISLIKE))
+        if disliked:
+            query -= 0.5 * blocks.vectors(disliked, weights_dict).mean(axis=0)
+        rows, _ = blocks.top_k(
+            query,
+            2 * n_candidates,
+            weights_dict,
+            item_type=item_type,
+            exclude=blocks.rows_of(profile.rated_ids(item_type)),
+        )
+        results: list[dict[str, Any]] = []
+        for item_id in blocks.item_ids[rows].tolist():
+            row = self.store.row_of(item_id)
+            # Deleted since the blocks were built
+            if row is None:
+                continue
+            results.append({"_id": item_id, "type": self.store.type_of(row)})
+            if len(results) == n_candidates:
+                break
+        return results or self.get_popular_items(n_candidates, filter)
@@ -2,9 +2,13 @@ from datetime import datetime
 from typing import Any, Self
 
 from pydantic import BaseModel, Field
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.collection import Collection
 from pymongo.database import Database
 
+from app.utils.document_cache import DocumentCache
+
 
 class MovieModel(BaseModel):
     id: str = Field(..., alias="_id")
@@ -38,19 +42,32 @@ class Movie:
             cls._instance = Movie()
         return cls._instance
 
-    def init(self, db: Database):
+    def init(self, db: Database, async_db: AsyncDatabase | None = None):
         self.db = db
         self.collection: Collection[dict[str, Any]] = db.get_collection("movies")
+        self.cache: DocumentCache[MovieModel] = DocumentCache("movie", MovieModel)
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("movies")
+            )
+
+    async def get_by_ids_async(self, ids: list[str]) -> dict[str, MovieModel]:
+        return await self.cache.get_many_async(ids, self._load_many_async)
 
-    def get_by_id(self, id: str):
-        movie = self.collection.find_one({"_id": id})
-        return MovieModel(**movie) if movie is not None else None
+    async def _load_many_async(self, ids: list[str]) -> dict[str, MovieModel]:
+        movies = self.async_collection.find({"_id": {"$in": ids}})
+        return {movie["_id"]: MovieModel(**movie) async for movie in movies}
 
-    def create(self, movie: MovieModel):
-        self.collection.insert_one(movie.model_dump(by_alias=True))
+    async def create_async(self, movie: MovieModel):
+        await self.async_collection.insert_one(movie.model_dump(by_alias=True))
+        await self.cache.invalidate_async(movie.id)
 
-    def update(self, movie: MovieModel):
-        self.collection.replace_one({"_id": movie.id}, movie.model_dump(by_alias=True))
+    async def update_async(self, movie: MovieModel):
+        await self.async_collection.replace_one(
+            {"_id": movie.id}, movie.model_dump(by_alias=True)
+        )
+        await self.cache.invalidate_async(movie.id)
 
-    def delete(self, id: str):
-        self.collection.delete_one({"_id": id})
+    async def delete_async(self, id: str):
+        await self.async_collection.delete_one({"_id": id})
+        await self.cache.invalidate_async(id)
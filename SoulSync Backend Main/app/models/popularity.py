@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Self
+
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from app.utils.logging import log as logger
+
+popularity_refresh_interval = int(os.getenv("POPULARITY_REFRESH_SECONDS", "300"))
+# Items ranked per media type, i.e. how deep cold start pages can go
+popularity_size = int(os.getenv("POPULARITY_SIZE", "1000"))
+# Weight of the like/dislike balance next to the normalised rating, and the
+# number of votes an item needs before that balance counts for half
+popularity_vote_weight = float(os.getenv("POPULARITY_VOTE_WEIGHT", "0.5"))
+popularity_vote_prior = float(os.getenv("POPULARITY_VOTE_PRIOR", "10"))
+
+
+def popularity_score(
+    rating: float,
+    max_rating: float,
+    likes: int,
+    dislikes: int,
+    vote_weight: float = popularity_vote_weight,
+    vote_prior: float = popularity_vote_prior,
+) -> float:
+    balance = (likes - dislikes) / (likes + dislikes + vote_prior)
+    return (rating or 0) / max_rating + vote_weight * balance
+
+
+class Popularity:
+    _instance: Self | None = None
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = Popularity()
+        return cls._instance
+
+    def __init__(self):
+        # Ranked {"_id", "type"} lists per media type plus "all"; empty until
+        # the first refresh, which callers treat as "not available"
+        self.rankings: dict[str, list[dict[str, Any]]] = {}
+        self.size = 0
+        self.refreshed_at: datetime | None = None
+
+    def init(self, db: Database, background: bool = False):
+        self.db = db
+        self.media_items: Collection[dict[str, Any]] = db.get_collection("mediaItems")
+        # Serve the scans of the refresh and the fallback query
+        self.media_items.create_index([("type", 1), ("rating", -1)])
+        self.media_items.create_index([("likes", -1)])
+        if background:
+            threading.Thread(
+                target=self._refresh_loop, name="popularity-refresh", daemon=True
+            ).start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing popularity: {e}")
+            time.sleep(popularity_refresh_interval)
+
+    def refresh(self, size: int = popularity_size):
+        start = time.perf_counter()
+        # Candidates are the best rated items of every type plus the most
+        # liked ones, so a highly liked item can outrank its rating; counts
+        # come from the counters on the media item documents
+        projection = {"type": 1, "rating": 1, "likes": 1, "dislikes": 1}
+        candidates: dict[str, dict[str, Any]] = {}
+        for item_type in self.media_items.distinct("type"):
+            for result in (
+                self.media_items.find({"type": item_type}, projection)
+                .sort("rating", -1)
+                .limit(size)
+            ):
+                candidates[result["_id"]] = result
+        for result in (
+            self.media_items.find({"likes": {"$gt": 0}}, projection)
+            .sort("likes", -1)
+            .limit(10 * size)
+        ):
+            candidates[result["_id"]] = result
+        max_rating = max(
+            [item.get("rating") or 0 for item in candidates.values()] + [1e-9]
+        )
+        ranked = sorted(
+            candidates.values(),
+            key=lambda item: popularity_score(
+                item.get("rating"),
+                max_rating,
+                item.get("likes", 0),
+                item.get("dislikes", 0),
+            ),
+            reverse=True,
+        )
+        rankings: dict[str, list[dict[str, Any]]] = {"all": []}
+        for item in ranked:
+            entry = {"_id": item["_id"], "type": item["type"]}
+            type_ranking = rankings.setdefault(item["type"], [])
+            if len(type_ranking) < size:
+                type_ranking.append(entry)
+            if len(rankings["all"]) < size:
+                rankings["all"].append(entry)
+        # Swapped in one assignment, so readers see either ranking whole
+        self.rankings = rankings
+        self.size = size
+        self.refreshed_at = datetime.now(timezone.utc)
+        logger.info(
+            f"Refreshed popularity of {len(candidates)} items in {time.perf_counter() - start:.2f}s"
+        )
+
+    def get(self, filter: str, n: int) -> list[dict[str, Any]] | None:
+        ranking = self.rankings.get(filter)
+        if ranking is None or n > self.size:
+            return None
+        return ranking[:n]
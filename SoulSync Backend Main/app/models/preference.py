@@ -1,10 +1,13 @@
 from enum import Enum
-from typing import Any, Self, Tuple
+from typing import Any, Callable, Self, Tuple
 
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from pymongo import IndexModel
+from pymongo import DeleteOne, IndexModel, ReturnDocument, UpdateOne
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Collection, Database
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from app.models.book import BookModel
 from app.models.movie import MovieModel
@@ -35,6 +38,27 @@ class PreferenceModel(BaseModel):
     preference: PreferenceType
 
 
+# A written preference and the value it replaced
+PreferenceChange = tuple[PreferenceModel, PreferenceType]
+
+
+class BulkPreferenceStatus(str, Enum):
+    created = "created"
+    updated = "updated"
+    deleted = "deleted"
+    unchanged = "unchanged"
+    # A later entry of the same batch was for the same item
+    superseded = "superseded"
+    invalid = "invalid"
+    failed = "failed"
+
+
+class BulkPreferenceResult(BaseModel):
+    media_item_id: str
+    status: BulkPreferenceStatus
+    previous: PreferenceType = PreferenceType.nil
+
+
 class Preference:
     _instance: Self | None = None
 
@@ -44,9 +68,24 @@ class Preference:
             cls._instance = Preference()
         return cls._instance
 
-    def init(self, db: Database):
+    def __init__(self):
+        # Called with the changes of every write, one per bulk request, e.g.
+        # to update cached profiles; set up here so listeners can register
+        # before init
+        self.listeners: list[Callable[[list[PreferenceChange]], None]] = []
+
+    def init(self, db: Database, async_db: AsyncDatabase | None = None):
         self.db = db
         self.collection: Collection[dict[str, Any]] = db.get_collection("preferences")
+        # Like and dislike counters live on the media item documents
+        self.media_items: Collection[dict[str, Any]] = db.get_collection("mediaItems")
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("preferences")
+            )
+            self.async_media_items: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("mediaItems")
+            )
         self.collection.create_indexes(
             [
                 IndexModel(
@@ -67,59 +106,201 @@ class Preference:
             ]
         )
 
-    def update_preference(self, preference: PreferenceModel):
+    async def update_preference_async(
+        self, preference: PreferenceModel
+    ) -> PreferenceType:
         filter_query = {
             "user_id": preference.user_id,
             "media_item_id": preference.media_item_id,
         }
-
         if preference.preference == PreferenceType.nil:
-            # Delete the preference if it exists
-            delete_result = self.collection.delete_one(filter_query)
-            if delete_result.deleted_count > 0:
-                logger.info(
-                    f"Preference deleted for user {preference.user_id} on item {preference.media_item_id}"
-                )
-            else:
-                logger.info(
-                    f"No preference found to delete for user {preference.user_id} on item {preference.media_item_id}"
-                )
+            previous = await self.async_collection.find_one_and_delete(filter_query)
         else:
-            # Update or insert the preference
             update_data = {"$set": {"preference": preference.preference}}
             try:
-                update_result = self.collection.update_one(
-                    filter_query, update_data, upsert=True
+                previous = await self.async_collection.find_one_and_update(
+                    filter_query,
+                    update_data,
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
                 )
-                if update_result.matched_count > 0:
-                    logger.info(
-                        f"Preference updated for user {preference.user_id} on item {preference.media_item_id}"
-                    )
-                elif update_result.upserted_id:
-                    logger.info(
-                        f"New preference created for user {preference.user_id} on item {preference.media_item_id}"
-                    )
             except DuplicateKeyError:
-                # This shouldn't happen due to our filter, but just in case
+                # A concurrent upsert inserted it first; it exists now
+                previous = await self.async_collection.find_one_and_update(
+                    filter_query, update_data, return_document=ReturnDocument.BEFORE
+                )
+        logger.info(
+            f"Preference {preference.preference.value or 'deleted'} for user {preference.user_id} on item {preference.media_item_id}"
+        )
+        previous_preference = (
+            PreferenceType(previous["preference"])
+            if previous is not None
+            else PreferenceType.nil
+        )
+        inc = self._counter_deltas(previous_preference, preference.preference)
+        if inc:
+            await self.async_media_items.update_one(
+                {"_id": preference.media_item_id}, {"$inc": inc}
+            )
+        # Listeners score vectors and may query synchronously
+        await run_in_threadpool(self._notify, [(preference, previous_preference)])
+        return previous_preference
+
+    async def update_preferences_async(
+        self, user_id: str, preferences: list[PreferenceModel]
+    ) -> list[BulkPreferenceResult]:
+        # One read of the values being replaced, one unordered bulk write of
+        # the changes and one of the counters, whatever the batch size. The
+        # last entry for an item wins, as if they were sent one by one.
+        latest = {
+            preference.media_item_id: index
+            for index, preference in enumerate(preferences)
+        }
+        results = [
+            BulkPreferenceResult(
+                media_item_id=preference.media_item_id,
+                status=BulkPreferenceStatus.superseded,
+            )
+            for preference in preferences
+        ]
+        if not latest:
+            return results
+        previous = await self.get_user_preferences_for_media_items_async(
+            user_id, list(latest)
+        )
+        requests: list[UpdateOne | DeleteOne] = []
+        written: list[int] = []
+        for media_item_id, index in latest.items():
+            preference = preferences[index]
+            results[index].previous = previous.get(media_item_id, PreferenceType.nil)
+            if results[index].previous == preference.preference:
+                results[index].status = BulkPreferenceStatus.unchanged
+                continue
+            filter_query = {"user_id": user_id, "media_item_id": media_item_id}
+            if preference.preference == PreferenceType.nil:
+                requests.append(DeleteOne(filter_query))
+            else:
+                requests.append(
+                    UpdateOne(
+                        filter_query,
+                        {"$set": {"preference": preference.preference}},
+                        upsert=True,
+                    )
+                )
+            written.append(index)
+        failed: set[int] = set()
+        if requests:
+            try:
+                await self.async_collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                failed = {error["index"] for error in e.details["writeErrors"]}
                 logger.error(
-                    f"Duplicate key error. Preference already exists for user {preference.user_id} on item {preference.media_item_id}"
+                    f"{len(failed)} of {len(requests)} preference writes failed for user {user_id}"
                 )
+        counters: list[UpdateOne] = []
+        changes: list[tuple[PreferenceModel, PreferenceType]] = []
+        for position, index in enumerate(written):
+            preference, result = preferences[index], results[index]
+            if position in failed:
+                result.status = BulkPreferenceStatus.failed
+                continue
+            if preference.preference == PreferenceType.nil:
+                result.status = BulkPreferenceStatus.deleted
+            elif result.previous == PreferenceType.nil:
+                result.status = BulkPreferenceStatus.created
+            else:
+                result.status = BulkPreferenceStatus.updated
+            # The previous values were read before the write, so a change to
+            # the same item racing this batch can skew its counters until
+            # reconcile_counters runs
+            inc = self._counter_deltas(result.previous, preference.preference)
+            counters.append(UpdateOne({"_id": preference.media_item_id}, {"$inc": inc}))
+            changes.append((preference, result.previous))
+        if counters:
+            await self.async_media_items.bulk_write(counters, ordered=False)
+        logger.info(
+            f"Bulk preferences for user {user_id}: {len(changes)} written, {len(failed)} failed"
+        )
+        if changes:
+            await run_in_threadpool(self._notify, changes)
+        return results
+
+    def _counter_deltas(
+        self, previous: PreferenceType, preference: PreferenceType
+    ) -> dict[str, int]:
+        # Deltas follow from the value the write replaced, so like -> dislike
+        # and deletes move both counters correctly
+        inc: dict[str, int] = {}
+        if previous == preference:
+            return inc
+        if previous != PreferenceType.nil:
+            inc[f"{previous.value}s"] = -1
+        if preference != PreferenceType.nil:
+            inc[f"{preference.value}s"] = 1
+        return inc
+
+    def _notify(self, changes: list[PreferenceChange]):
+        for listener in self.listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Error in preference listener: {e}")
+
+    def add_listener(self, listener: Callable[[list[PreferenceChange]], None]):
+        self.listeners.append(listener)
 
     def get_user_preference(self, user_id: str):
         results = self.collection.find({"user_id": user_id})
         return [PreferenceModel(**result) for result in results]
 
-    def get_user_preference_for_media_item(self, user_id: str, media_item_id: str):
-        result = self.collection.find_one(
-            {"user_id": user_id, "media_item_id": media_item_id}
+    def get_liked_ids(self, user_id: str) -> list[str]:
+        results = self.collection.find(
+            {"user_id": user_id, "preference": PreferenceType.like},
+            {"_id": 0, "media_item_id": 1},
         )
-        return (
-            PreferenceModel(**result).preference
-            if result is not None
-            else PreferenceType.nil
+        return [result["media_item_id"] for result in results]
+
+    def get_user_ids(self, batch_size: int = 1000):
+        # Streams the ids of every user with at least one preference
+        cursor = self.collection.aggregate(
+            [{"$group": {"_id": "$user_id"}}], allowDiskUse=True, batchSize=batch_size
         )
+        for result in cursor:
+            yield result["_id"]
+
+    def get_users_preferences(
+        self, user_ids: list[str]
+    ) -> dict[str, list[PreferenceModel]]:
+        preferences: dict[str, list[PreferenceModel]] = {
+            user_id: [] for user_id in user_ids
+        }
+        for result in self.collection.find({"user_id": {"$in": user_ids}}):
+            preferences[result["user_id"]].append(PreferenceModel(**result))
+        return preferences
 
-    def get_media_preference(self, media_item_id: str) -> Tuple[int, int]:
+    async def get_user_preferences_for_media_items_async(
+        self, user_id: str, media_item_ids: list[str]
+    ) -> dict[str, PreferenceType]:
+        results = self.async_collection.find(
+            {"user_id": user_id, "media_item_id": {"$in": media_item_ids}}
+        )
+        return {
+            result["media_item_id"]: PreferenceType(result["preference"])
+            async for result in results
+        }
+
+    async def get_media_preferences_async(
+        self, media_item_ids: list[str]
+    ) -> dict[str, Tuple[int, int]]:
+        results = self.async_media_items.find(
+            {"_id": {"$in": media_item_ids}}, {"likes": 1, "dislikes": 1}
+        )
+        return {
+            result["_id"]: (result.get("likes", 0), result.get("dislikes", 0))
+            async for result in results
+        }
+
+    def count_media_preference(self, media_item_id: str) -> Tuple[int, int]:
         pipeline = [
             {"$match": {"media_item_id": media_item_id}},
             {"$group": {"_id": "$preference", "count": {"$sum": 1}}},
@@ -141,3 +322,68 @@ class Preference:
                 raise ValueError(f"Unknown preference type: {result['preference']}")
 
         return likes, dislikes
+
+    def count_media_preferences(self, batch_size: int = 10_000):
+        # Streams (media item id, likes, dislikes) for every rated item
+        cursor = self.collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": "$media_item_id",
+                        "likes": {
+                            "$sum": {"$cond": [{"$eq": ["$preference", "like"]}, 1, 0]}
+                        },
+                        "dislikes": {
+                            "$sum": {
+                                "$cond": [{"$eq": ["$preference", "dislike"]}, 1, 0]
+                            }
+                        },
+                    }
+                }
+            ],
+            allowDiskUse=True,
+            batchSize=batch_size,
+        )
+        for result in cursor:
+            yield result["_id"], result["likes"], result["dislikes"]
+
+    def reconcile_counters(self, batch_size: int = 1000) -> int:
+        # Counters drift when a process dies between a preference write and
+        # its $inc. Mismatched items are recounted on their own right before
+        # the repair, which only applies if the counters did not move since
+        # they were read; anything skipped is repaired by the next run.
+        counts = {
+            media_item_id: (likes, dislikes)
+            for media_item_id, likes, dislikes in self.count_media_preferences()
+        }
+        repaired = 0
+        requests: list[UpdateOne] = []
+        for item in self.media_items.find(
+            {}, {"likes": 1, "dislikes": 1}, batch_size=batch_size
+        ):
+            current = (item.get("likes", 0), item.get("dislikes", 0))
+            if counts.get(item["_id"], (0, 0)) == current:
+                continue
+            likes, dislikes = self.count_media_preference(item["_id"])
+            if (likes, dislikes) == current:
+                continue
+            requests.append(
+                UpdateOne(
+                    {
+                        "_id": item["_id"],
+                        "likes": item.get("likes"),
+                        "dislikes": item.get("dislikes"),
+                    },
+                    {"$set": {"likes": likes, "dislikes": dislikes}},
+                )
+            )
+            if len(requests) == batch_size:
+                repaired += self.media_items.bulk_write(
+                    requests, ordered=False
+                ).modified_count
+                requests = []
+        if requests:
+            repaired += self.media_items.bulk_write(
+                requests, ordered=False
+            ).modified_count
+        return repaired
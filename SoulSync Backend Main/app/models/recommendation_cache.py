@@ -0,0 +1,81 @@
+import base64
+import binascii
+import json
+import os
+import uuid
+from typing import Any, Self
+
+from app.models.preference import Preference, PreferenceChange
+from app.utils.cache import LRUCache
+
+# Ranked candidates kept per scoring pass, i.e. how far "load more" can page
+candidate_pool = int(os.getenv("RECOMMEND_CANDIDATES", "200"))
+recommend_cache_ttl = int(os.getenv("RECOMMEND_CACHE_TTL_SECONDS", "900"))
+# Cap on the candidates held across every cached list
+recommend_cache_items = int(os.getenv("RECOMMEND_CACHE_ITEMS", "2000000"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(token: str, offset: int) -> str:
+    data = json.dumps({"t": token, "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        token, offset = str(data["t"]), int(data["o"])
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if offset < 0:
+        raise InvalidCursor("Invalid cursor")
+    return token, offset
+
+
+class RecommendationCache:
+    _instance: Self | None = None
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = RecommendationCache()
+        return cls._instance
+
+    def init(
+        self,
+        max_items: int = recommend_cache_items,
+        ttl: int = recommend_cache_ttl,
+    ):
+        # Keyed by user, each value maps the request's scoring parameters to
+        # (token, ranked candidates), so invalidating a user is one delete
+        self.cache: LRUCache[dict[tuple, tuple[str, list[dict[str, Any]]]]] = LRUCache(
+            max_items,
+            ttl,
+            size=lambda lists: sum(len(items) for _, items in lists.values()),
+        )
+        Preference.getInstance().add_listener(self._on_preferences)
+
+    def _on_preferences(self, changes: list[PreferenceChange]):
+        for user_id in {preference.user_id for preference, _ in changes}:
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: str):
+        self.cache.delete(user_id)
+
+    def get(self, user_id: str, key: tuple, token: str) -> list[dict[str, Any]] | None:
+        lists = self.cache.get(user_id)
+        if lists is None or key not in lists:
+            return None
+        cached_token, items = lists[key]
+        return items if cached_token == token else None
+
+    def put(self, user_id: str, key: tuple, items: list[dict[str, Any]]) -> str:
+        token = uuid.uuid4().hex[:16]
+        lists = dict(self.cache.get(user_id) or {})
+        lists[key] = (token, items)
+        self.cache.set(user_id, lists)
+        return token
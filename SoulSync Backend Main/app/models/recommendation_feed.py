@@ -0,0 +1,89 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Self
+
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ReplaceOne
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# Feeds older than this are ignored and /recommend scores live instead
+feed_max_age = timedelta(seconds=int(os.getenv("FEED_MAX_AGE_SECONDS", "3600")))
+
+
+class FeedItemModel(BaseModel):
+    id: str = Field(..., alias="_id")
+    type: str
+
+
+class RecommendationFeedModel(BaseModel):
+    id: str = Field(..., alias="_id")
+    user_id: str
+    filter: str
+    items: list[FeedItemModel]
+    generated_at: datetime
+
+
+def feed_id(user_id: str, filter: str) -> str:
+    return f"{user_id}:{filter}"
+
+
+class RecommendationFeed:
+    _instance: Self | None = None
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = RecommendationFeed()
+        return cls._instance
+
+    def init(self, db: Database, async_db: AsyncDatabase | None = None):
+        self.db = db
+        self.collection: Collection[dict[str, Any]] = db.get_collection(
+            "recommendationFeeds"
+        )
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("recommendationFeeds")
+            )
+        self.collection.create_indexes([IndexModel({"user_id": 1}, name="user")])
+
+    def save_feeds(self, filter: str, feeds: dict[str, list[dict[str, Any]]]):
+        if not feeds:
+            return
+        generated_at = datetime.now(timezone.utc)
+        self.collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": feed_id(user_id, filter)},
+                    RecommendationFeedModel(
+                        _id=feed_id(user_id, filter),
+                        user_id=user_id,
+                        filter=filter,
+                        items=items,
+                        generated_at=generated_at,
+                    ).model_dump(by_alias=True),
+                    upsert=True,
+                )
+                for user_id, items in feeds.items()
+            ],
+            ordered=False,
+        )
+
+    async def get_feed_async(
+        self, user_id: str, filter: str, max_age: timedelta = feed_max_age
+    ) -> list[dict[str, Any]] | None:
+        result = await self.async_collection.find_one(
+            {
+                "_id": feed_id(user_id, filter),
+                "generated_at": {"$gte": datetime.now(timezone.utc) - max_age},
+            }
+        )
+        if result is None:
+            return None
+        return RecommendationFeedModel(**result).model_dump(by_alias=True)["items"]
+
+    async def invalidate_async(self, user_id: str):
+        await self.async_collection.delete_many({"user_id": user_id})
@@ -1,13 +1,26 @@
+import multiprocessing
 import os
-from typing import Any, Self
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Self, TypeVar
 
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.collection import Collection
 from pymongo.database import Database
 
-from app.utils.password import get_password_hash, verify_password
+from app.utils.executor import BoundedExecutor
+from app.utils.password import get_password_hash, verify_and_update_password
 from app.utils.uuid import gen_uuid
 
+# Processes that hash and verify passwords, and the calls that may wait for
+# one before logins and signups are refused
+password_workers = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+password_max_queue = int(os.getenv("PASSWORD_MAX_QUEUE", "32"))
+
+T = TypeVar("T")
+
 
 class UserModel(BaseModel):
     id: str = Field(alias="_id", default_factory=gen_uuid)
@@ -44,9 +57,13 @@ class User:
             cls._instance = User()
         return cls._instance
 
-    def init(self, db: Database):
+    def init(self, db: Database, async_db: AsyncDatabase | None = None):
         self.db = db
         self.collection: Collection[dict[str, Any]] = db.get_collection("users")
+        if async_db is not None:
+            self.async_collection: AsyncCollection[dict[str, Any]] = (
+                async_db.get_collection("users")
+            )
         admin_email = os.getenv("ADMIN_EMAIL", "test@example.com")
         if self.collection.find_one({"email": admin_email}) is None:
             admin_password = os.getenv("ADMIN_PASSWORD", "password")
@@ -57,24 +74,63 @@ class User:
                 full_name=admin_name,
             )
             self.collection.insert_one(admin_user.model_dump(by_alias=True))
+        self.hashing: BoundedExecutor | None = None
+
+    def start_hashing(
+        self, workers: int = password_workers, max_queue: int = password_max_queue
+    ):
+        # bcrypt holds the GIL, so it gets processes rather than threads;
+        # spawned, since forking a process with Mongo client threads is unsafe
+        self.hashing = BoundedExecutor(
+            "password",
+            ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            ),
+            workers,
+            max_queue,
+        )
+
+    def stop_hashing(self):
+        if self.hashing is not None:
+            self.hashing.shutdown()
+            self.hashing = None
 
-    def create(self, user: UserCreateModel):
-        user.password = get_password_hash(user.password)
+    async def _hash(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.hashing is None:
+            return await run_in_threadpool(fn, *args)
+        return await self.hashing.run(fn, *args)
+
+    async def create_async(self, user: UserCreateModel):
+        user.password = await self._hash(get_password_hash, user.password)
         new_user = UserModel(**user.model_dump())
-        self.collection.insert_one(new_user.model_dump(by_alias=True))
+        await self.async_collection.insert_one(new_user.model_dump(by_alias=True))
 
-    def verify(self, user: UserVerifyModel) -> bool:
-        result = self.collection.find_one({"email": user.email})
+    async def verify_async(self, user: UserVerifyModel) -> UserModel | None:
+        # One read serves both the check and the token claims
+        result = await self.async_collection.find_one({"email": user.email})
         if result is None:
-            return False
+            return None
         db_user = UserModel(**result)
-        if not verify_password(user.password, db_user.password):
-            return False
-        return True
+        valid, new_hash = await self._hash(
+            verify_and_update_password, user.password, db_user.password
+        )
+        if not valid:
+            return None
+        if new_hash is not None:
+            # The hash is of another cost factor; conditional, so a password
+            # changed in the meantime is not overwritten
+            await self.async_collection.update_one(
+                {"_id": db_user.id, "password": db_user.password},
+                {"$set": {"password": new_hash}},
+            )
+            db_user.password = new_hash
+        return db_user
 
-    def get_by_email(self, email: str):
-        result = self.collection.find_one({"email": email})
-        return UserModel(**result) if result is not None else None
+    async def validate_user_id_async(self, user_id: str) -> bool:
+        return (
+            await self.async_collection.find_one({"_id": user_id}, {"_id": 1})
+            is not None
+        )
 
-    def validate_user_id(self, user_id: str) -> bool:
-        return self.collection.find_one({"_id": user_id}) is not None
+    def is_admin(self, user: dict[str, Any]) -> bool:
+        return user.get("email") == os.getenv("ADMIN_EMAIL", "test@example.com")
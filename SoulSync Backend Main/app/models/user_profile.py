@@ -0,0 +1,176 @@
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Self
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from app.models.media_item import MediaItem
+from app.models.preference import Preference, PreferenceChange
+from app.utils.cache import LRUCache
+from app.utils.logging import log as logger
+from app.vectors.profiles import ProfileVectors
+
+profile_cache_size = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+# Bounds the memory of profiles that are no longer read
+profile_ttl = int(os.getenv("PROFILE_TTL_SECONDS", "600"))
+persist_profiles = os.getenv("PERSIST_PROFILES", "false").lower() == "true"
+
+
+class UserProfile:
+    _instance: Self | None = None
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = UserProfile()
+        return cls._instance
+
+    def init(self, db: Database, persist: bool = persist_profiles):
+        self.db = db
+        self.collection: Collection[dict[str, Any]] = db.get_collection("userProfiles")
+        # Every preference write bumps preferences_version on the user
+        # document, so profiles cached by any worker are checked against the
+        # writes of all of them
+        self.users: Collection[dict[str, Any]] = db.get_collection("users")
+        self.persist = persist
+        # Values are ((artifact fitted_at, preferences_version), profile).
+        # Compaction keeps the vector space, so profiles outlive it; sums
+        # built under another fit are in a different space and are rebuilt
+        self.cache: LRUCache[tuple[tuple[str, int], ProfileVectors]] = LRUCache(
+            profile_cache_size, profile_ttl
+        )
+        self._lock = threading.Lock()
+        # Writes are numbered, and the last one of every user whose profile
+        # is being built is kept, so a build that missed one is not cached
+        self._sequence = 0
+        self._building: dict[str, int] = {}
+        self._written: dict[str, int] = {}
+        Preference.getInstance().add_listener(self.apply)
+
+    def _artifact_version(self) -> str:
+        return MediaItem.getInstance().artifact.manifest["fitted_at"]
+
+    def _preferences_version(self, user_id: str) -> int:
+        result = self.users.find_one({"_id": user_id}, {"preferences_version": 1})
+        return 0 if result is None else result.get("preferences_version", 0)
+
+    def get(self, user_id: str, attempts: int = 3) -> ProfileVectors:
+        # The returned profile is never modified afterwards. The version is
+        # read before the preferences, so a build that races a write is
+        # cached under the version the write replaced and rebuilt next time.
+        version = (self._artifact_version(), self._preferences_version(user_id))
+        cached = self.cache.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        for _ in range(attempts):
+            with self._lock:
+                start = self._sequence
+                self._building[user_id] = self._building.get(user_id, 0) + 1
+            try:
+                profile = self._load(user_id, version)
+                built = profile is None
+                if built:
+                    preferences = Preference.getInstance().get_user_preference(user_id)
+                    profile = MediaItem.getInstance().build_profile(preferences)
+            finally:
+                with self._lock:
+                    missed = self._written.get(user_id, -1) > start
+                    self._building[user_id] -= 1
+                    if self._building[user_id] == 0:
+                        del self._building[user_id]
+                        self._written.pop(user_id, None)
+                    if not missed:
+                        self.cache.set(user_id, (version, profile))
+            if not missed:
+                if built:
+                    self._save(user_id, version, profile)
+                return profile
+        # Still racing writes; serve the last build without caching it
+        return profile
+
+    def apply(self, changes: list[PreferenceChange]):
+        # Only cached profiles are updated; the rest are built from the
+        # preferences, which already include these writes, on their next
+        # read. Each user's profile is copied and saved once per batch.
+        fitted_at = self._artifact_version()
+        by_user: dict[str, list[PreferenceChange]] = {}
+        for change in changes:
+            by_user.setdefault(change[0].user_id, []).append(change)
+        # Bumped after the write, so other workers rebuild what they cached
+        versions: dict[str, int | None] = {}
+        for user_id in by_user:
+            result = self.users.find_one_and_update(
+                {"_id": user_id},
+                {"$inc": {"preferences_version": 1}},
+                {"preferences_version": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            versions[user_id] = (
+                None if result is None else result["preferences_version"]
+            )
+        updated: dict[str, tuple[tuple[str, int], ProfileVectors]] = {}
+        with self._lock:
+            for user_id, user_changes in by_user.items():
+                self._sequence += 1
+                if user_id in self._building:
+                    self._written[user_id] = self._sequence
+                cached = self.cache.get(user_id)
+                preferences_version = versions[user_id]
+                if (
+                    cached is None
+                    or preferences_version is None
+                    or cached[0] != (fitted_at, preferences_version - 1)
+                ):
+                    # Not cached, built under another fit, or another worker
+                    # wrote in between; rebuilt on the next read
+                    self.cache.delete(user_id)
+                    continue
+                # Copied, so readers scoring the cached profile are unaffected
+                profile = cached[1].copy()
+                for preference, _ in user_changes:
+                    MediaItem.getInstance().apply_preference(
+                        profile, preference.media_item_id, preference.preference
+                    )
+                version = (fitted_at, preferences_version)
+                self.cache.set(user_id, (version, profile))
+                updated[user_id] = (version, profile)
+        # Stored profiles of the other users carry an older version and are
+        # no longer loaded
+        for user_id, (version, profile) in updated.items():
+            self._save(user_id, version, profile)
+
+    def _load(self, user_id: str, version: tuple[str, int]) -> ProfileVectors | None:
+        if not self.persist:
+            return None
+        result = self.collection.find_one(
+            {
+                "_id": user_id,
+                "artifact": version[0],
+                "preferences_version": version[1],
+            }
+        )
+        if result is None:
+            return None
+        try:
+            return ProfileVectors.from_dict(result["profile"])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable profile of user {user_id}: {e}")
+            return None
+
+    def _save(self, user_id: str, version: tuple[str, int], profile: ProfileVectors):
+        if not self.persist:
+            return
+        self.collection.replace_one(
+            {"_id": user_id},
+            {
+                "_id": user_id,
+                "artifact": version[0],
+                "preferences_version": version[1],
+                "profile": profile.to_dict(),
+                "updated_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
+        )
@@ -7,11 +7,11 @@ router = APIRouter()
 
 
 @router.post("/create", status_code=status.HTTP_201_CREATED)
-def handleCreate(
+async def handleCreate(
     item: BookModel,
 ):
     try:
-        Book.getInstance().create(item)
+        await Book.getInstance().create_async(item)
     except Exception as e:
         logger.error(f"Error in create book: {str(e)}")
         raise HTTPException(
@@ -20,11 +20,11 @@ def handleCreate(
 
 
 @router.patch("/update", status_code=status.HTTP_200_OK)
-def handleUpdate(
+async def handleUpdate(
     item: BookModel,
 ):
     try:
-        Book.getInstance().update(item)
+        await Book.getInstance().update_async(item)
     except Exception as e:
         logger.error(f"Error in update book: {str(e)}")
         raise HTTPException(
@@ -33,11 +33,16 @@ def handleUpdate(
 
 
 @router.delete("/delete", status_code=status.HTTP_200_OK)
-def handleDelete(id: str = Query(..., min_length=1, description="book id")):
+async def handleDelete(id: str = Query(..., min_length=1, description="book id")):
     try:
-        Book.getInstance().delete(id)
+        await Book.getInstance().delete_async(id)
     except Exception as e:
         logger.error(f"Error in delete book: {str(e)}")
         raise HTTPException(
             status_code=500, detail="An error occurred during deleting book"
         )
+
+
+@router.get("/cache", status_code=status.HTTP_200_OK)
+async def handleCacheStats():
+    return Book.getInstance().cache.stats()
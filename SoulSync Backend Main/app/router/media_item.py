@@ -1,73 +1,195 @@
+import asyncio
 import gc
-from typing import Annotated, Any
+from typing import Any
 
-from fastapi import (APIRouter, BackgroundTasks, Header, HTTPException, Query,
-                     status)
+from fastapi import (APIRouter, BackgroundTasks, HTTPException, Query,
+                     Response, status)
+from fastapi.concurrency import run_in_threadpool
 
 from app.models.book import Book
-from app.models.media_item import MediaItem, MediaItemModel, MediaItemType
+from app.models.media_item import (FeatureWeights, MediaItem, MediaItemModel,
+                                   MediaItemType, SearchMode, TextSearchMode)
 from app.models.movie import Movie
-from app.models.preference import Preference, UserBookModel, UserMovieModel
+from app.models.preference import (Preference, PreferenceType, UserBookModel,
+                                   UserMovieModel)
+from app.models.recommendation_cache import (InvalidCursor,
+                                             RecommendationCache,
+                                             candidate_pool, decode_cursor,
+                                             encode_cursor)
+from app.models.recommendation_feed import RecommendationFeed
+from app.models.user import User
+from app.models.user_profile import UserProfile
+from app.utils.executor import ExecutorBusy
 from app.utils.logging import log as logger
-from app.utils.password import decode_token
+from app.utils.password import CurrentUser
 
 router = APIRouter()
 
 
-def get_item(user_id: str, item: dict[str, Any]):
-    if item["type"] == MediaItemType.book:
-        book = Book.getInstance().get_by_id(item["_id"])
-        if book is None:
-            logger.error(f"Book not found: {item['_id']}")
-            return None
-        likes, dislikes = Preference.getInstance().get_media_preference(item["_id"])
-        preference = Preference.getInstance().get_user_preference_for_media_item(
-            user_id, item["_id"]
-        )
-        return UserBookModel(
-            **book.model_dump(by_alias=True),
-            likes=likes,
-            dislikes=dislikes,
-            preference=preference,
-        )
-    elif item["type"] == MediaItemType.movie:
-        movie = Movie.getInstance().get_by_id(item["_id"])
-        if movie is None:
-            logger.error(f"Movie not found: {item['_id']}")
+async def get_items(user_id: str, items: list[dict[str, Any]]):
+    # One query per media type, one for the like/dislike counts and one for
+    # the user's own preferences, whatever the number of items, all in flight
+    # at once
+    ids_by_type: dict[str, list[str]] = {}
+    for item in items:
+        if item["type"] not in (MediaItemType.book, MediaItemType.movie):
+            logger.error(f"Unknown media type: {item['type']}")
+            raise ValueError(f"Unknown media type: {item['type']}")
+        ids_by_type.setdefault(item["type"], []).append(item["_id"])
+    ids = [item["_id"] for item in items]
+    books, movies, counts, preferences = await asyncio.gather(
+        Book.getInstance().get_by_ids_async(ids_by_type.get(MediaItemType.book, [])),
+        Movie.getInstance().get_by_ids_async(ids_by_type.get(MediaItemType.movie, [])),
+        Preference.getInstance().get_media_preferences_async(ids),
+        Preference.getInstance().get_user_preferences_for_media_items_async(
+            user_id, ids
+        ),
+    )
+    results: list[UserBookModel | UserMovieModel] = []
+    for item in items:
+        likes, dislikes = counts.get(item["_id"], (0, 0))
+        preference = preferences.get(item["_id"], PreferenceType.nil)
+        if item["type"] == MediaItemType.book:
+            book = books.get(item["_id"])
+            if book is None:
+                logger.error(f"Book not found: {item['_id']}")
+                continue
+            results.append(
+                UserBookModel(
+                    **book.model_dump(by_alias=True),
+                    likes=likes,
+                    dislikes=dislikes,
+                    preference=preference,
+                )
+            )
+        else:
+            movie = movies.get(item["_id"])
+            if movie is None:
+                logger.error(f"Movie not found: {item['_id']}")
+                continue
+            results.append(
+                UserMovieModel(
+                    **movie.model_dump(by_alias=True),
+                    likes=likes,
+                    dislikes=dislikes,
+                    preference=preference,
+                )
+            )
+    return results
+
+
+def parse_weights(preset: str | None, weights: str | None) -> FeatureWeights | None:
+    # "title:0.2,description:0.8" or a named preset; None keeps the defaults
+    media_item = MediaItem.getInstance()
+    try:
+        if weights is not None:
+            parsed = {}
+            for part in weights.split(","):
+                feature, _, value = part.partition(":")
+                parsed[feature.strip()] = float(value)
+            feature_weights = FeatureWeights.from_dict(parsed)
+        elif preset is not None:
+            if preset not in media_item.weight_presets:
+                raise ValueError(f"Unknown weight preset: {preset}")
+            feature_weights = media_item.weight_presets[preset]
+        else:
             return None
-        likes, dislikes = Preference.getInstance().get_media_preference(item["_id"])
-        preference = Preference.getInstance().get_user_preference_for_media_item(
-            user_id, item["_id"]
-        )
-        return UserMovieModel(
-            **movie.model_dump(by_alias=True),
-            likes=likes,
-            dislikes=dislikes,
-            preference=preference,
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if (
+        feature_weights.to_dict() != media_item.artifact.manifest["weights"]
+        and media_item.blocks is None
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Custom weights are not available",
         )
-    else:
-        logger.error(f"Unknown media type: {item['type']}")
-        raise ValueError(f"Unknown media type: {item['type']}")
+    return feature_weights
 
 
 @router.get("/recommend", status_code=status.HTTP_200_OK)
-def handleRecommend(
+async def handleRecommend(
     background_tasks: BackgroundTasks,
+    response: Response,
+    user: CurrentUser,
     filter: MediaItemType = Query(
         MediaItemType.all, description="Filter by media type"
     ),
-    authorization: Annotated[str | None, Header()] = None,
     limit: int = Query(10, description="How many items to return?"),
+    search: SearchMode | None = Query(
+        None, description="Exact or approximate (ANN) scoring"
+    ),
+    nprobe: int | None = Query(
+        None, ge=1, description="Inverted lists probed by ANN scoring"
+    ),
+    cf_weight: float | None = Query(
+        None, ge=0, le=1, description="Share of collaborative filtering in the score"
+    ),
+    cursor: str | None = Query(
+        None, description="X-Next-Cursor of the previous page, to load more"
+    ),
+    preset: str | None = Query(None, description="Named feature weights"),
+    weights: str | None = Query(
+        None, description="Feature weights, e.g. description:0.7,genres:0.3"
+    ),
 ):
+    feature_weights = parse_weights(preset, weights)
     try:
-        user = decode_token(authorization)
-        preferences = Preference.getInstance().get_user_preference(user["id"])
-        results = MediaItem.getInstance().get_recommendations(
-            filter, preferences, limit
+        token, offset = decode_cursor(cursor) if cursor else (None, 0)
+        cache = RecommendationCache.getInstance()
+        key = (
+            filter.value,
+            search,
+            nprobe,
+            cf_weight,
+            (
+                None
+                if feature_weights is None
+                else tuple(feature_weights.to_dict().values())
+            ),
         )
-        items = [get_item(user["id"], item) for item in results]
+        candidates = cache.get(user["id"], key, token) if token else None
+        if candidates is None:
+            # Default scoring may be served from the materialised feed
+            if (
+                search is None
+                and nprobe is None
+                and cf_weight is None
+                and feature_weights is None
+            ):
+                feed = await RecommendationFeed.getInstance().get_feed_async(
+                    user["id"], filter.value
+                )
+                if feed is not None and len(feed) >= offset + limit:
+                    candidates = feed
+            if candidates is None:
+                # Scoring runs on its own executor, so a burst of recommend
+                # calls cannot starve the threadpool of the other endpoints
+                profile = await run_in_threadpool(
+                    UserProfile.getInstance().get, user["id"]
+                )
+                candidates = await MediaItem.getInstance().get_candidates_async(
+                    filter,
+                    profile,
+                    max(candidate_pool, offset + limit),
+                    search=search,
+                    nprobe=nprobe,
+                    cf_weight=cf_weight,
+                    weights=feature_weights,
+                )
+            token = cache.put(user["id"], key, candidates)
+        results = candidates[offset : offset + limit]
+        if offset + limit < len(candidates):
+            response.headers["X-Next-Cursor"] = encode_cursor(token, offset + limit)
+        items = await get_items(user["id"], results)
         background_tasks.add_task(gc.collect)
-        return [i for i in items if i is not None]
+        return items
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ExecutorBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error in recommend: {str(e)}")
         raise HTTPException(
@@ -80,19 +202,26 @@ def handleRecommend(
     status_code=status.HTTP_200_OK,
     response_model=list[UserBookModel | UserMovieModel],
 )
-def handleSearch(
-    authorization: Annotated[str | None, Header()] = None,
+async def handleSearch(
+    user: CurrentUser,
     filter: MediaItemType = Query(
         MediaItemType.all, description="Filter by media type"
     ),
     search: str = Query(..., min_length=1, description="Search query"),
     limit: int = Query(10, description="How many items to return?"),
+    mode: TextSearchMode | None = Query(
+        None, description="Mongo text index, item vectors, or vectors reranked by text"
+    ),
 ):
     try:
-        user = decode_token(authorization)
-        results = MediaItem.getInstance().search(filter, search, limit)
-        items = [get_item(user["id"], item) for item in results]
-        return [i for i in items if i is not None]
+        results = await MediaItem.getInstance().search_async(
+            filter, search, limit, mode
+        )
+        return await get_items(user["id"], results)
+    except ExecutorBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error in search media item: {str(e)}")
         raise HTTPException(
@@ -100,12 +229,97 @@ def handleSearch(
         )
 
 
+@router.get("/suggest", status_code=status.HTTP_200_OK)
+async def handleSuggest(
+    q: str = Query(..., min_length=1, description="What has been typed so far"),
+    filter: MediaItemType = Query(
+        MediaItemType.all, description="Filter by media type"
+    ),
+    limit: int = Query(10, ge=1, le=50, description="How many items to return?"),
+):
+    try:
+        return MediaItem.getInstance().suggest(q, limit, filter)
+    except Exception as e:
+        logger.error(f"Error in suggest media items: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred during suggesting items"
+        )
+
+
+@router.get(
+    "/{id}/similar",
+    status_code=status.HTTP_200_OK,
+    response_model=list[UserBookModel | UserMovieModel],
+)
+async def handleSimilar(
+    id: str,
+    user: CurrentUser,
+    filter: MediaItemType = Query(
+        MediaItemType.all, description="Filter by media type"
+    ),
+    limit: int = Query(10, ge=1, description="How many items to return?"),
+):
+    try:
+        results = await MediaItem.getInstance().get_similar_async(id, limit, filter)
+        if results is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Media item not found"
+            )
+        return await get_items(user["id"], results)
+    except HTTPException:
+        raise
+    except ExecutorBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error in similar media items: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred during finding similar items"
+        )
+
+
+@router.get("/vectors", status_code=status.HTTP_200_OK)
+async def handleVectorStatus():
+    try:
+        return MediaItem.getInstance().vector_status()
+    except Exception as e:
+        logger.error(f"Error in vector status: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred during reading vector status"
+        )
+
+
+@router.get("/scoring", status_code=status.HTTP_200_OK)
+async def handleScoringStats():
+    scoring = MediaItem.getInstance().scoring
+    return None if scoring is None else scoring.stats()
+
+
+@router.post("/vectors/rebuild", status_code=status.HTTP_202_ACCEPTED)
+def handleVectorRebuild(user: CurrentUser):
+    try:
+        if not User.getInstance().is_admin(user):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN, detail="Admin only"
+            )
+        started = MediaItem.getInstance().rebuild()
+        return {"started": started, **MediaItem.getInstance().vector_status()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in vector rebuild: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred during starting the rebuild"
+        )
+
+
 @router.post("/create", status_code=status.HTTP_201_CREATED)
-def handleCreate(
+async def handleCreate(
     item: MediaItemModel,
 ):
     try:
-        MediaItem.getInstance().create(item)
+        await MediaItem.getInstance().create_async(item)
     except Exception as e:
         logger.error(f"Error in create media item: {str(e)}")
         raise HTTPException(
@@ -114,11 +328,11 @@ def handleCreate(
 
 
 @router.patch("/update", status_code=status.HTTP_200_OK)
-def handleUpdate(
+async def handleUpdate(
     item: MediaItemModel,
 ):
     try:
-        MediaItem.getInstance().update(item)
+        await MediaItem.getInstance().update_async(item)
     except Exception as e:
         logger.error(f"Error in update media item: {str(e)}")
         raise HTTPException(
@@ -127,9 +341,9 @@ def handleUpdate(
 
 
 @router.delete("/delete", status_code=status.HTTP_200_OK)
-def handleDelete(id: str = Query(..., min_length=1, description="media item id")):
+async def handleDelete(id: str = Query(..., min_length=1, description="media item id")):
     try:
-        MediaItem.getInstance().delete(id)
+        await MediaItem.getInstance().delete_async(id)
     except Exception as e:
         logger.error(f"Error in delete media item: {str(e)}")
         raise HTTPException(
@@ -7,11 +7,11 @@ router = APIRouter()
 
 
 @router.post("/create", status_code=status.HTTP_201_CREATED)
-def handleCreate(
+async def handleCreate(
     item: MovieModel,
 ):
     try:
-        Movie.getInstance().create(item)
+        await Movie.getInstance().create_async(item)
     except Exception as e:
         logger.error(f"Error in create movie: {str(e)}")
         raise HTTPException(
@@ -20,11 +20,11 @@ def handleCreate(
 
 
 @router.patch("/update", status_code=status.HTTP_200_OK)
-def handleUpdate(
+async def handleUpdate(
     item: MovieModel,
 ):
     try:
-        Movie.getInstance().update(item)
+        await Movie.getInstance().update_async(item)
     except Exception as e:
         logger.error(f"Error in update movie: {str(e)}")
         raise HTTPException(
@@ -33,11 +33,16 @@ def handleUpdate(
 
 
 @router.delete("/delete", status_code=status.HTTP_200_OK)
-def handleDelete(id: str = Query(..., min_length=1, description="movie id")):
+async def handleDelete(id: str = Query(..., min_length=1, description="movie id")):
     try:
-        Movie.getInstance().delete(id)
+        await Movie.getInstance().delete_async(id)
     except Exception as e:
         logger.error(f"Error in delete movie: {str(e)}")
         raise HTTPException(
             status_code=500, detail="An error occurred during deleting movie"
         )
+
+
+@router.get("/cache", status_code=status.HTTP_200_OK)
+async def handleCacheStats():
+    return Movie.getInstance().cache.stats()
@@ -1,35 +1,42 @@
-from typing import Annotated
+import asyncio
+import os
 
-from fastapi import APIRouter, Header, HTTPException, status
+from fastapi import APIRouter, HTTPException, status
 
 from app.models.media_item import MediaItem
-from app.models.preference import Preference, PreferenceModel
+from app.models.preference import (BulkPreferenceResult, BulkPreferenceStatus,
+                                   Preference, PreferenceModel)
+from app.models.recommendation_feed import RecommendationFeed
 from app.models.user import User
 from app.utils.logging import log as logger
-from app.utils.password import decode_token
+from app.utils.password import CurrentUser
+
+# Preferences accepted by one /bulk call
+bulk_max_size = int(os.getenv("PREFERENCE_BULK_MAX_SIZE", "500"))
 
 router = APIRouter()
 
 
 @router.post("/upsert", status_code=status.HTTP_200_OK, response_model=None)
-def handleUpsert(
-    preference: PreferenceModel, authorization: Annotated[str | None, Header()] = None
-) -> None:
+async def handleUpsert(preference: PreferenceModel, user: CurrentUser) -> None:
     try:
-        user = decode_token(authorization)
         if user["id"] != preference.user_id:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User id does not match token",
             )
-        if not User.getInstance().validate_user_id(
-            preference.user_id
-        ) or not MediaItem.getInstance().validate_media_id(preference.media_item_id):
+        valid_user, valid_media_item = await asyncio.gather(
+            User.getInstance().validate_user_id_async(preference.user_id),
+            MediaItem.getInstance().validate_media_id_async(preference.media_item_id),
+        )
+        if not valid_user or not valid_media_item:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid user or media_item id",
             )
-        Preference.getInstance().update_preference(preference)
+        await Preference.getInstance().update_preference_async(preference)
+        # The user's feeds were ranked without this preference
+        await RecommendationFeed.getInstance().invalidate_async(preference.user_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -37,3 +44,75 @@ def handleUpsert(
         raise HTTPException(
             status_code=500, detail="An error occurred during the update"
         )
+
+
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=list[BulkPreferenceResult],
+)
+async def handleBulkUpsert(
+    preferences: list[PreferenceModel], user: CurrentUser
+) -> list[BulkPreferenceResult]:
+    if len(preferences) > bulk_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {bulk_max_size} preferences per request",
+        )
+    try:
+        if any(preference.user_id != user["id"] for preference in preferences):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User id does not match token",
+            )
+        valid_user, valid_media_ids = await asyncio.gather(
+            User.getInstance().validate_user_id_async(user["id"]),
+            MediaItem.getInstance().validate_media_ids_async(
+                list({preference.media_item_id for preference in preferences})
+            ),
+        )
+        if not valid_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user id"
+            )
+        # Unknown media items are reported per item; the rest are written
+        written = iter(
+            await Preference.getInstance().update_preferences_async(
+                user["id"],
+                [
+                    preference
+                    for preference in preferences
+                    if preference.media_item_id in valid_media_ids
+                ],
+            )
+        )
+        results = [
+            (
+                next(written)
+                if preference.media_item_id in valid_media_ids
+                else BulkPreferenceResult(
+                    media_item_id=preference.media_item_id,
+                    status=BulkPreferenceStatus.invalid,
+                )
+            )
+            for preference in preferences
+        ]
+        if any(
+            result.status
+            in (
+                BulkPreferenceStatus.created,
+                BulkPreferenceStatus.updated,
+                BulkPreferenceStatus.deleted,
+            )
+            for result in results
+        ):
+            # The user's feeds were ranked without these preferences
+            await RecommendationFeed.getInstance().invalidate_async(user["id"])
+        return results
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in bulk upsert preferences: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred during the update"
+        )
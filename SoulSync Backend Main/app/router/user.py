@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
 
 from app.models.user import User, UserCreateModel, UserVerifyModel
+from app.utils.executor import ExecutorBusy
 from app.utils.logging import log as logger
 from app.utils.password import create_access_token
 
@@ -14,11 +15,15 @@ class Token(BaseModel):
 
 
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
-def handleSignup(user: UserCreateModel):
+async def handleSignup(user: UserCreateModel):
     try:
         logger.debug(f"signing up user {user.email}")
-        User.getInstance().create(user)
+        await User.getInstance().create_async(user)
         logger.debug(f"Created user {user.email}")
+    except ExecutorBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error in signup: {str(e)}")
         raise HTTPException(
@@ -28,19 +33,12 @@ def handleSignup(user: UserCreateModel):
 
 
 @router.post("/login", status_code=status.HTTP_200_OK, response_model=Token)
-def handleLogin(user: UserVerifyModel):
+async def handleLogin(user: UserVerifyModel):
     try:
         logger.debug(f"logging in user {user.email}")
-        user_db = User.getInstance()
-        if not user_db.verify(user):
-            logger.debug(f"failed logging in user {user.email}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-            )
-        logged_user = user_db.get_by_email(user.email)
+        logged_user = await User.getInstance().verify_async(user)
         if logged_user is None:
-            logger.debug(f"(shouldn't happen) failed logging in user {user.email}")
+            logger.debug(f"failed logging in user {user.email}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials",
@@ -51,6 +49,10 @@ def handleLogin(user: UserVerifyModel):
     except HTTPException:
         # Re-raise HTTPExceptions without modifying them
         raise
+    except ExecutorBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error in login: {str(e)}")
         raise HTTPException(
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    # Thread safe LRU with a per entry TTL. The cap is counted in whatever
+    # unit `size` returns, one per entry by default.
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float | None = None,
+        size: Callable[[V], int] | None = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._size = size or (lambda _: 1)
+        self._entries: OrderedDict[Any, tuple[float, int, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Any, value: V):
+        size = self._size(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (expires_at, size, value)
+            self.current_size += size
+            while self.current_size > self.max_size and self._entries:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key: Any):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_size = 0
+
+    def _pop(self, key: Any):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_size -= entry[1]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "size": self.current_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,194 @@
+import os
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from app.utils.cache import LRUCache
+from app.utils.logging import log as logger
+
+document_cache_size = int(os.getenv("DOCUMENT_CACHE_SIZE", "50000"))
+# Other workers only see an update once their local copy expires
+document_cache_ttl = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "300"))
+# Optional shared tier, e.g. redis://redis:6379/0; unset keeps caching local
+redis_url = os.getenv("REDIS_URL", "")
+shared_cache_ttl = int(os.getenv("SHARED_CACHE_TTL_SECONDS", "86400"))
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class DocumentCache(Generic[M]):
+    # Validated models in a per process LRU, backed by JSON in Redis that
+    # every worker shares; Mongo is only read when both tiers miss
+    def __init__(
+        self,
+        name: str,
+        model: type[M],
+        max_size: int = document_cache_size,
+        ttl: int = document_cache_ttl,
+        url: str = redis_url,
+        shared_ttl: int = shared_cache_ttl,
+    ):
+        self.name = name
+        self.model = model
+        self.local: LRUCache[M] = LRUCache(max_size, ttl)
+        self.shared_ttl = shared_ttl
+        self.shared = None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.loads = 0
+        # Bumped by every invalidate. While reads are in flight, the
+        # generation each key was last invalidated at is kept, so a read that
+        # started before it does not cache what it found.
+        self.generation = 0
+        self.reads_in_flight = 0
+        self.invalidated: dict[str, int] = {}
+        if url:
+            try:
+                import redis
+
+                self.shared = redis.Redis.from_url(url)
+            except Exception as e:
+                logger.error(f"Shared {name} cache disabled: {e}")
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _generation_key(self, key: str) -> str:
+        # Incremented by every worker's invalidate of the key
+        return f"{self.name}:generation:{key}"
+
+    def _shared_get_many(
+        self, keys: list[str]
+    ) -> tuple[dict[str, M], dict[str, bytes | None]]:
+        # Also returns the keys' generations, which a later write of what
+        # was loaded for them is checked against
+        if self.shared is None or not keys:
+            return {}, {}
+        try:
+            values = self.shared.mget(
+                [self._key(key) for key in keys]
+                + [self._generation_key(key) for key in keys]
+            )
+        except Exception as e:
+            logger.error(f"Error reading shared {self.name} cache: {e}")
+            return {}, {}
+        found = {
+            key: self.model.model_validate_json(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+        self.shared_hits += len(found)
+        self.shared_misses += len(keys) - len(found)
+        return found, dict(zip(keys, values[len(keys) :]))
+
+    def _shared_set_many(
+        self, documents: dict[str, M], generations: dict[str, bytes | None]
+    ):
+        if self.shared is None or not documents:
+            return
+        from redis.exceptions import WatchError
+
+        generation_keys = [self._generation_key(key) for key in documents]
+        try:
+            with self.shared.pipeline() as pipeline:
+                # The write is dropped if any key is invalidated before it
+                # commits, and keys invalidated since they were read are
+                # skipped, so no worker caches a copy older than an update
+                pipeline.watch(*generation_keys)
+                current = pipeline.mget(generation_keys)
+                pipeline.multi()
+                for (key, document), generation in zip(documents.items(), current):
+                    if generation != generations.get(key):
+                        continue
+                    pipeline.set(
+                        self._key(key),
+                        document.model_dump_json(by_alias=True),
+                        ex=self.shared_ttl,
+                    )
+                pipeline.execute()
+        except WatchError:
+            logger.debug(f"Shared {self.name} cache write raced an invalidate")
+        except Exception as e:
+            logger.error(f"Error writing shared {self.name} cache: {e}")
+
+    def _get_local(self, keys: list[str]) -> tuple[dict[str, M], list[str]]:
+        documents: dict[str, M] = {}
+        missing: list[str] = []
+        for key in keys:
+            document = self.local.get(key)
+            if document is None:
+                missing.append(key)
+            else:
+                documents[key] = document
+        return documents, missing
+
+    def _set_local(self, found: dict[str, M], start: int):
+        for key, document in found.items():
+            # Read before an invalidate that has since landed: returned to
+            # this caller, but not kept
+            if self.invalidated.get(key, start) <= start:
+                self.local.set(key, document)
+
+    async def get_many_async(
+        self,
+        keys: list[str],
+        load_many: Callable[[list[str]], Awaitable[dict[str, M]]],
+    ) -> dict[str, M]:
+        # The Redis client is blocking, so the shared tier runs off the loop
+        documents, missing = self._get_local(keys)
+        if not missing:
+            return documents
+        start = self.generation
+        self.reads_in_flight += 1
+        try:
+            shared: dict[str, M] = {}
+            generations: dict[str, bytes | None] = {}
+            if self.shared is not None:
+                shared, generations = await run_in_threadpool(
+                    self._shared_get_many, missing
+                )
+                missing = [key for key in missing if key not in shared]
+            loaded: dict[str, M] = {}
+            if missing:
+                self.loads += len(missing)
+                loaded = await load_many(missing)
+                if self.shared is not None and loaded:
+                    await run_in_threadpool(self._shared_set_many, loaded, generations)
+            found = {**shared, **loaded}
+            self._set_local(found, start)
+            documents.update(found)
+            return documents
+        finally:
+            self.reads_in_flight -= 1
+            if self.reads_in_flight == 0:
+                self.invalidated.clear()
+
+    def _shared_delete(self, key: str):
+        try:
+            pipeline = self.shared.pipeline()
+            pipeline.incr(self._generation_key(key))
+            pipeline.expire(self._generation_key(key), self.shared_ttl)
+            pipeline.delete(self._key(key))
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error invalidating shared {self.name} cache: {e}")
+
+    async def invalidate_async(self, key: str):
+        self.generation += 1
+        if self.reads_in_flight:
+            self.invalidated[key] = self.generation
+        self.local.delete(key)
+        if self.shared is not None:
+            await run_in_threadpool(self._shared_delete, key)
+
+    def stats(self) -> dict[str, int | dict[str, int] | None]:
+        return {
+            "local": self.local.stats(),
+            "shared": (
+                None
+                if self.shared is None
+                else {"hits": self.shared_hits, "misses": self.shared_misses}
+            ),
+            "mongo_reads": self.loads,
+        }
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+def _timed(fn: Callable[..., T], *args: Any) -> tuple[float, T]:
+    # Wall clock, so the start can be compared across processes too
+    return time.time(), fn(*args)
+
+
+def _summary(samples: deque[float]) -> dict[str, float] | None:
+    if not samples:
+        return None
+    values = np.fromiter(samples, dtype=np.float64) * 1000
+    p50, p95 = np.percentile(values, [50, 95])
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+class BoundedExecutor:
+    # Runs blocking calls for async handlers on a pool of their own, so one
+    # kind of work cannot starve the threadpool everything else shares. At
+    # most max_queue calls wait for a worker; further ones raise ExecutorBusy
+    # rather than queueing without bound. Counters are only touched from the
+    # event loop, so they need no lock.
+    def __init__(
+        self,
+        name: str,
+        executor: Executor,
+        max_workers: int,
+        max_queue: int,
+        window: int = 1000,
+    ):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # Seconds from submission to a worker picking the call up, and from
+        # there to its result, over the last `window` calls
+        self.waits: deque[float] = deque(maxlen=window)
+        self.runs: deque[float] = deque(maxlen=window)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusy(f"The {self.name} executor is busy")
+        self.in_flight += 1
+        self.submitted += 1
+        submitted_at = time.time()
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(_timed, fn, *args)
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.waits.append(max(0.0, started_at - submitted_at))
+        self.runs.append(time.time() - started_at)
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": _summary(self.waits),
+            "run_ms": _summary(self.runs),
+        }
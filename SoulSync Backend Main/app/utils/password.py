@@ -1,16 +1,34 @@
+import hashlib
 import os
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Annotated, Any
 
 import jwt
-from fastapi import HTTPException, Request
+from fastapi import Depends, HTTPException, Request
 from passlib.context import CryptContext
 
+from app.utils.cache import LRUCache
+
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Recently verified tokens, so a client's requests skip the HMAC and JSON
+# decoding of a token already seen; entries are dropped once it expires
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# bcrypt cost factor; hashes of any other cost are replaced on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Keyed by a digest of the token, so the cache holds no usable credentials
+verified_tokens: LRUCache[dict[str, Any]] = LRUCache(TOKEN_CACHE_SIZE)
 
 
 # Function to verify the password
@@ -18,6 +36,12 @@ def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# Function to verify the password, with a new hash if the stored one is
+# outdated, e.g. after BCRYPT_ROUNDS changed
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 # Function to hash the password
 def get_password_hash(password: str):
     return pwd_context.hash(password)
@@ -36,14 +60,22 @@ def decode_token(header: str | None):
     if header is None or header == "" or len(header) < 7 or header[:7] != "Bearer ":
         raise HTTPException(status_code=401, detail="Token is missing")
     token = header[7:]
+    key = hashlib.sha256(token.encode()).digest()
+    payload = verified_tokens.get(key)
+    if payload is not None and payload["exp"] > time.time():
+        return dict(payload)
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if "exp" in payload:
+        verified_tokens.set(key, dict(payload))
+    else:
+        verified_tokens.delete(key)
     return payload
 
 
 # Function to verify the access token extracted from the request
 def verify_access_token(request: Request):
     # Extract the token from the request
-    token = request.headers["Authorization"]
+    token = request.headers.get("Authorization")
     try:
         return decode_token(token)
     except jwt.ExpiredSignatureError:
@@ -52,3 +84,17 @@ def verify_access_token(request: Request):
     except jwt.InvalidTokenError:
         # Raise an HTTPException with status code 401 if the token is invalid
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+# Dependency for the claims the authenticate middleware attached to the
+# request, so handlers do not decode the token a second time. Async, so
+# FastAPI runs it on the event loop instead of sending a dict lookup
+# through the threadpool.
+async def get_current_user(request: Request) -> dict[str, Any]:
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = verify_access_token(request)
+    return user
+
+
+CurrentUser = Annotated[dict[str, Any], Depends(get_current_user)]
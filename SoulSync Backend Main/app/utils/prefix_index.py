@@ -0,0 +1,117 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Iterable
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    return TOKEN_PATTERN.findall((text or "").casefold())
+
+
+class PrefixIndex:
+    # Typeahead over title and creator tokens. Keys are (token, -rating, slot)
+    # in one sorted list, so the items whose tokens start with a prefix are a
+    # contiguous range found with bisect, best rated first within a token.
+    def __init__(self, max_scan: int = 5000):
+        # Keys looked at per query, which bounds very short prefixes
+        self.max_scan = max_scan
+        self.keys: list[tuple[str, float, int]] = []
+        self.items: list[dict[str, Any] | None] = []
+        self.tokens: list[tuple[str, ...]] = []
+        self.slots: dict[str, int] = {}
+        self._free: list[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def _item_keys(self, slot: int) -> list[tuple[str, float, int]]:
+        rating = -(self.items[slot]["rating"] or 0.0)
+        return [(token, rating, slot) for token in self.tokens[slot]]
+
+    def _store(self, item: dict[str, Any]) -> int:
+        slot = self._free.pop() if self._free else len(self.items)
+        entry = {
+            "_id": item["_id"],
+            "title": item["title"],
+            "type": item["type"],
+            "rating": item.get("rating"),
+        }
+        tokens = tuple(
+            sorted(set(tokenize(item["title"]) + tokenize(item.get("creator"))))
+        )
+        if slot == len(self.items):
+            self.items.append(entry)
+            self.tokens.append(tokens)
+        else:
+            self.items[slot] = entry
+            self.tokens[slot] = tokens
+        self.slots[item["_id"]] = slot
+        return slot
+
+    def build(self, items: Iterable[dict[str, Any]]):
+        with self._lock:
+            self.keys = []
+            self.items = []
+            self.tokens = []
+            self.slots = {}
+            self._free = []
+            for item in items:
+                self.keys.extend(self._item_keys(self._store(item)))
+            self.keys.sort()
+
+    def add(self, item: dict[str, Any]):
+        with self._lock:
+            self._remove(item["_id"])
+            for key in self._item_keys(self._store(item)):
+                insort(self.keys, key)
+
+    def remove(self, item_id: str):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id: str):
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return
+        for key in self._item_keys(slot):
+            del self.keys[bisect_left(self.keys, key)]
+        self.items[slot] = None
+        self.tokens[slot] = ()
+        self._free.append(slot)
+
+    def search(
+        self, query: str, limit: int = 10, item_type: str | None = None
+    ) -> list[dict[str, Any]]:
+        # The last word is a prefix; earlier ones must prefix some other token
+        # of the same item, so "harr pot" finds "Harry Potter"
+        words = tokenize(query)
+        if not words:
+            return []
+        prefix, others = words[-1], words[:-1]
+        results: list[dict[str, Any]] = []
+        seen: set[int] = set()
+        with self._lock:
+            start = bisect_left(self.keys, (prefix,))
+            for token, _, slot in self.keys[start : start + self.max_scan]:
+                if not token.startswith(prefix):
+                    break
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                item = self.items[slot]
+                if item_type is not None and item["type"] != item_type:
+                    continue
+                if not all(
+                    any(other.startswith(word) for other in self.tokens[slot])
+                    for word in others
+                ):
+                    continue
+                results.append(
+                    {"_id": item["_id"], "title": item["title"], "type": item["type"]}
+                )
+                if len(results) == limit:
+                    break
+        return results
@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+from app.vectors.scoring import normalize_rows, top_k
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+ROWS_FILE = "ivf_rows.npy"
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size=100_000):
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = vectors[start : start + chunk_size]
+        assignments[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    n_lists: int,
+    n_iter: int = 15,
+    sample_size: int = 100_000,
+    seed: int = 42,
+) -> np.ndarray:
+    # Spherical k-means on a sample: rows are unit length, so the closest
+    # centroid is the one with the largest dot product
+    rng = np.random.default_rng(seed)
+    n_rows = vectors.shape[0]
+    sample = vectors[np.sort(rng.choice(n_rows, min(sample_size, n_rows), False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    n_lists = min(n_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Empty lists are reseeded with random sample rows
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    # Inverted file index: rows are bucketed by their closest centroid, and a
+    # query only scores the rows in its nprobe closest buckets
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        nprobe: int = 8,
+    ):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: int | None = None,
+        centroids: np.ndarray | None = None,
+        nprobe: int = 8,
+        seed: int = 42,
+    ) -> "IVFIndex":
+        if centroids is None:
+            n_lists = n_lists or max(1, int(4 * np.sqrt(vectors.shape[0])))
+            centroids = train_centroids(vectors, n_lists, seed=seed)
+        assignments = assign(vectors, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, offsets, rows, nprobe)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(path, OFFSETS_FILE), self.offsets)
+        np.save(os.path.join(path, ROWS_FILE), self.rows)
+
+    @classmethod
+    def load(
+        cls, path: str, nprobe: int = 8, mmap_mode: str | None = "r"
+    ) -> "IVFIndex | None":
+        if not os.path.exists(os.path.join(path, CENTROIDS_FILE)):
+            return None
+        return cls(
+            np.load(os.path.join(path, CENTROIDS_FILE)),
+            np.load(os.path.join(path, OFFSETS_FILE)),
+            np.load(os.path.join(path, ROWS_FILE), mmap_mode=mmap_mode),
+            nprobe,
+        )
+
+    def candidates(self, query: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        return np.concatenate(
+            [self.rows[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        )
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        nprobe: int | None = None,
+        allowed: slice | np.ndarray | None = None,
+        exclude: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        rows = self.candidates(query, nprobe)
+        if isinstance(allowed, slice):
+            rows = rows[(rows >= allowed.start) & (rows < allowed.stop)]
+        elif allowed is not None:
+            rows = rows[np.isin(rows, allowed)]
+        if exclude is not None and len(exclude) > 0:
+            rows = rows[~np.isin(rows, exclude)]
+        # Sorted rows keep the gather from the memory mapped matrix sequential
+        rows = np.sort(rows)
+        local, scores = top_k(vectors[rows] @ query, k)
+        return rows[local], scores
+
+
+def recall_at_k(exact: np.ndarray, approximate: np.ndarray) -> float:
+    if len(exact) == 0:
+        return 1.0
+    return len(np.intersect1d(exact, approximate)) / len(exact)
+
+
+def evaluate_recall(
+    vectors: np.ndarray,
+    index: IVFIndex,
+    k: int = 10,
+    n_queries: int = 200,
+    nprobe: int | None = None,
+    seed: int = 42,
+) -> float:
+    # Items themselves are used as queries, which is what recommend scores
+    # against: profiles are averages of item rows
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(vectors.shape[0], min(n_queries, vectors.shape[0]))]
+    recalls = []
+    for query in np.asarray(queries, dtype=np.float32):
+        exact, _ = top_k(vectors @ query, k)
+        approximate, _ = index.search(vectors, query, k, nprobe)
+        recalls.append(recall_at_k(exact, approximate))
+    return float(np.mean(recalls))
@@ -0,0 +1,161 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+import joblib
+import numpy as np
+
+from app.vectors.ann import IVFIndex, evaluate_recall
+from app.vectors.encoder import ItemEncoder
+from app.vectors.quantize import QuantizedVectors, evaluate_quantized_recall
+from app.vectors.scoring import normalize_rows
+from app.vectors.versions import new_version, publish_version, resolve_version
+
+# Bump whenever the on-disk layout changes so stale artifacts get rebuilt
+ARTIFACT_VERSION = 4
+
+MANIFEST_FILE = "manifest.json"
+ENCODER_FILE = "encoder.joblib"
+VECTORS_FILE = "reduced.npy"
+IDS_FILE = "ids.npy"
+TYPES_FILE = "types.npy"
+# Serialises every writer of the artifact in a vector dir across processes
+LOCK_FILE = ".lock"
+
+
+@contextmanager
+def artifact_lock(vector_dir: str):
+    with open(os.path.join(vector_dir, LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+@dataclass
+class VectorArtifact:
+    path: str
+    manifest: dict[str, Any]
+    reduced_vectors: np.ndarray
+    item_ids: np.ndarray
+    item_types: np.ndarray
+    ann: IVFIndex | None = None
+    quantized: QuantizedVectors | None = None
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"]
+
+    def load_encoder(self) -> ItemEncoder:
+        # The encoder is only needed to embed new text, so serving processes
+        # never pay for its vocabularies and projection unless they ask
+        return joblib.load(os.path.join(self.path, ENCODER_FILE), mmap_mode="r")
+
+
+def save_artifact(
+    path: str,
+    reduced_vectors: np.ndarray,
+    item_ids: list[str],
+    item_types: list[str],
+    encoder: ItemEncoder,
+    ann_lists: int | None = None,
+    ann_centroids: np.ndarray | None = None,
+    ann_nprobe: int = 8,
+    fitted_at: str | None = None,
+    build_seconds: float | None = None,
+    quantization: str | None = None,
+    quantized_rerank: int = 200,
+    read_at: str | None = None,
+) -> dict[str, Any]:
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "n_items": int(reduced_vectors.shape[0]),
+        "n_components": int(reduced_vectors.shape[1]),
+        "seed": encoder.projection.random_state,
+        "weights": encoder.weights,
+    }
+    # When the encoder was fitted: compaction keeps it, so artifacts with the
+    # same value share a vector space
+    manifest["fitted_at"] = fitted_at or manifest["created_at"]
+    if build_seconds is not None:
+        manifest["build_seconds"] = round(build_seconds, 3)
+    # When a build began reading the items from Mongo, if the artifact holds
+    # exactly what it read; compactions and caught up builds leave it out
+    if read_at is not None:
+        manifest["read_at"] = read_at
+    # Written to a version of its own, then published, so readers never see
+    # a half written artifact and ones mapping the previous version keep it
+    version_path = new_version(path)
+    # Rows are grouped by type so each type partition is a contiguous slice,
+    # and stored unit length so the scoring engine can use them as is
+    types = np.asarray(item_types, dtype=str)
+    order = np.argsort(types, kind="stable")
+    vectors = normalize_rows(np.asarray(reduced_vectors)[order])
+    np.save(os.path.join(version_path, VECTORS_FILE), vectors)
+    np.save(
+        os.path.join(version_path, IDS_FILE), np.asarray(item_ids, dtype=str)[order]
+    )
+    np.save(os.path.join(version_path, TYPES_FILE), types[order])
+    joblib.dump(encoder, os.path.join(version_path, ENCODER_FILE))
+    if ann_lists or ann_centroids is not None:
+        ann = IVFIndex.build(
+            vectors, ann_lists, ann_centroids, ann_nprobe, seed=manifest["seed"]
+        )
+        ann.save(version_path)
+        manifest["ann"] = {
+            "n_lists": ann.n_lists,
+            "nprobe": ann_nprobe,
+            "recall_at_10": evaluate_recall(vectors, ann, nprobe=ann_nprobe),
+        }
+    if quantization:
+        quantized = QuantizedVectors.build(vectors, quantization)
+        quantized.save(version_path)
+        manifest["quantization"] = {
+            "mode": quantized.mode,
+            "bytes": quantized.nbytes,
+            "full_bytes": int(vectors.nbytes),
+            "saved_bytes": int(vectors.nbytes - quantized.nbytes),
+            "rerank": quantized_rerank,
+            **evaluate_quantized_recall(vectors, quantized, quantized_rerank),
+        }
+    with open(os.path.join(version_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    publish_version(path, version_path)
+    return manifest
+
+
+def read_manifest(path: str) -> dict[str, Any] | None:
+    manifest_path = os.path.join(resolve_version(path), MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_artifact(
+    path: str, mmap_mode: str | None = "r", ann_nprobe: int | None = None
+) -> VectorArtifact:
+    path = resolve_version(path)
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No vector artifact found at {path}")
+    if manifest["version"] != ARTIFACT_VERSION:
+        raise ValueError(
+            f"Vector artifact version {manifest['version']} is not supported, expected {ARTIFACT_VERSION}"
+        )
+    # With mmap_mode every worker maps the same files, so the matrix lives
+    # once in the page cache instead of once per process
+    return VectorArtifact(
+        path=path,
+        manifest=manifest,
+        reduced_vectors=np.load(os.path.join(path, VECTORS_FILE), mmap_mode=mmap_mode),
+        item_ids=np.load(os.path.join(path, IDS_FILE), mmap_mode=mmap_mode),
+        item_types=np.load(os.path.join(path, TYPES_FILE), mmap_mode=mmap_mode),
+        ann=IVFIndex.load(
+            path, ann_nprobe or manifest.get("ann", {}).get("nprobe", 8), mmap_mode
+        ),
+        quantized=QuantizedVectors.load(path, mmap_mode),
+    )
@@ -0,0 +1,171 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+from scipy import sparse
+from sklearn.random_projection import GaussianRandomProjection
+
+from app.vectors.artifact import IDS_FILE, TYPES_FILE
+from app.vectors.scoring import normalize_rows, top_k
+from app.vectors.store import partition_rows
+from app.vectors.versions import new_version, publish_version, resolve_version
+
+BLOCKS_DIR = "feature_blocks"
+MANIFEST_FILE = "manifest.json"
+BLOCKS_FILE = "blocks.npy"
+GRAMS_FILE = "grams.npy"
+
+
+def build_feature_blocks(
+    path: str,
+    features: dict[str, Any],
+    weights: dict[str, float],
+    projection: GaussianRandomProjection,
+    item_ids: list[str],
+    item_types: list[str],
+    fitted_at: str | None = None,
+    chunk_size: int = 50_000,
+) -> dict[str, Any]:
+    # The projection is linear, so projecting each feature's columns on their
+    # own gives blocks whose weighted sum is the item vector for any weights
+    names = [name for name in weights if name in features]
+    components = projection.components_
+    if sparse.issparse(components):
+        components = components.toarray()
+    types = np.asarray(item_types, dtype=str)
+    order = np.argsort(types, kind="stable")
+    n_items, n_components = len(order), components.shape[0]
+    version_path = new_version(path)
+    blocks = np.lib.format.open_memmap(
+        os.path.join(version_path, BLOCKS_FILE),
+        "w+",
+        np.float32,
+        (len(names), n_items, n_components),
+    )
+    offset = 0
+    for f, name in enumerate(names):
+        matrix = features[name]
+        if not sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+        matrix = matrix.tocsr()
+        block_components = components[:, offset : offset + matrix.shape[1]].T
+        offset += matrix.shape[1]
+        for start in range(0, n_items, chunk_size):
+            rows = order[start : start + chunk_size]
+            blocks[f, start : start + len(rows)] = matrix[rows] @ block_components
+    # Per item Gram matrices of the blocks give the norm of any weighted sum
+    # without materialising it
+    grams = np.lib.format.open_memmap(
+        os.path.join(version_path, GRAMS_FILE),
+        "w+",
+        np.float32,
+        (n_items, len(names), len(names)),
+    )
+    for start in range(0, n_items, chunk_size):
+        chunk = blocks[:, start : start + chunk_size]
+        grams[start : start + chunk.shape[1]] = np.einsum("fnd,gnd->nfg", chunk, chunk)
+    blocks.flush()
+    grams.flush()
+    del blocks, grams
+    np.save(
+        os.path.join(version_path, IDS_FILE), np.asarray(item_ids, dtype=str)[order]
+    )
+    np.save(os.path.join(version_path, TYPES_FILE), types[order])
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        # Blocks only line up with the artifact fitted with the same projection
+        "fitted_at": fitted_at,
+        "features": names,
+        "n_items": n_items,
+        "n_components": n_components,
+    }
+    with open(os.path.join(version_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    publish_version(path, version_path)
+    return manifest
+
+
+class FeatureBlocks:
+    def __init__(
+        self,
+        manifest: dict[str, Any],
+        item_ids: np.ndarray,
+        item_types: np.ndarray,
+        blocks: np.ndarray,
+        grams: np.ndarray,
+    ):
+        self.manifest = manifest
+        self.features: list[str] = manifest["features"]
+        self.item_ids = item_ids
+        self.item_types = item_types
+        self.blocks = blocks
+        self.grams = grams
+        self.id_to_row: dict[str, int] = {
+            item_id: row for row, item_id in enumerate(item_ids.tolist())
+        }
+        self.partitions = partition_rows(item_types)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "FeatureBlocks | None":
+        path = resolve_version(path)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return cls(
+            manifest,
+            *(
+                np.load(os.path.join(path, file), mmap_mode=mmap_mode)
+                for file in (IDS_FILE, TYPES_FILE, BLOCKS_FILE, GRAMS_FILE)
+            ),
+        )
+
+    def rows_of(self, item_ids: list[str]) -> list[int]:
+        rows = [self.id_to_row.get(item_id) for item_id in item_ids]
+        return [row for row in rows if row is not None]
+
+    def weight_vector(self, weights: dict[str, float]) -> np.ndarray:
+        return np.asarray(
+            [weights.get(feature, 0.0) for feature in self.features], dtype=np.float32
+        )
+
+    def vectors(self, rows: list[int], weights: dict[str, float]) -> np.ndarray:
+        rows = np.sort(np.asarray(rows, dtype=np.intp))
+        w = self.weight_vector(weights)
+        return normalize_rows(np.einsum("f,fnd->nd", w, self.blocks[:, rows]))
+
+    def top_k(
+        self,
+        query: np.ndarray,
+        k: int,
+        weights: dict[str, float],
+        item_type: str | None = None,
+        exclude: list[int] | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # cos(sum_f w_f B_f, q) = sum_f w_f (B_f q) / sqrt(w' G w): one
+        # matrix-vector product per weighted block plus the Gram norms
+        rows = slice(0, len(self.item_ids))
+        if item_type is not None:
+            rows = self.partitions.get(item_type, np.empty(0, dtype=np.intp))
+        norm = np.linalg.norm(query)
+        query = np.asarray(query / norm if norm > 0 else query, dtype=np.float32)
+        w = self.weight_vector(weights)
+        n_rows = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+        dots = np.zeros(n_rows, dtype=np.float32)
+        for f in np.flatnonzero(w):
+            dots += w[f] * (self.blocks[f, rows] @ query)
+        norms = np.sqrt(
+            np.maximum(np.einsum("nfg,f,g->n", self.grams[rows], w, w), 1e-12)
+        )
+        scores = dots / norms
+        exclude_rows = np.asarray(exclude or [], dtype=np.intp)
+        if isinstance(rows, slice):
+            local_exclude = exclude_rows - rows.start
+        else:
+            local_exclude = np.flatnonzero(np.isin(rows, exclude_rows))
+        local_exclude = local_exclude[(local_exclude >= 0) & (local_exclude < n_rows)]
+        local, scores = top_k(scores, k, local_exclude)
+        return (local + rows.start if isinstance(rows, slice) else rows[local]), scores
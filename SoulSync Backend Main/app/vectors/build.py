@@ -0,0 +1,334 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+import joblib
+import numpy as np
+from pymongo.collection import Collection
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.random_projection import GaussianRandomProjection
+
+from app.utils.logging import log as logger
+from app.vectors.artifact import (ARTIFACT_VERSION, artifact_lock,
+                                  read_manifest, save_artifact)
+from app.vectors.blocks import BLOCKS_DIR, build_feature_blocks
+from app.vectors.encoder import (TEXT_FEATURES, ItemEncoder, item_columns,
+                                 scale_column, weight_features)
+
+FEATURES_FILE = "item_vectors.joblib"
+FEATURES_VERSION = 4
+ARTIFACT_DIR = "artifact"
+PROJECTED_FIELDS = [
+    "type",
+    "title",
+    "description",
+    "creator",
+    "genres",
+    "release_date",
+    "pages_runtime",
+]
+
+# Items written this long before a build began reading are re-read too,
+# covering clock skew between the API hosts and the build
+CATCH_UP_MARGIN = timedelta(
+    seconds=int(os.getenv("VECTOR_CATCH_UP_MARGIN_SECONDS", "60"))
+)
+
+Progress = Callable[[str, int, int], None]
+
+
+def log_progress(stage: str, done: int, total: int):
+    logger.info(f"[vectors] {stage}: {done}/{total}")
+
+
+def stream_columns(
+    collection: Collection,
+    batch_size: int = 10_000,
+    progress: Progress = log_progress,
+) -> tuple[list[str], list[str], dict[str, list]]:
+    # One projected cursor over the collection; documents are turned into
+    # column lists batch by batch instead of being paged with skip/limit
+    total = collection.estimated_document_count()
+    item_ids: list[str] = []
+    item_types: list[str] = []
+    columns: dict[str, list] = {}
+    cursor = collection.find(
+        {}, {field: 1 for field in PROJECTED_FIELDS}, batch_size=batch_size
+    )
+    batch: list[dict[str, Any]] = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            _append_batch(batch, item_ids, item_types, columns)
+            batch = []
+            progress("reading", len(item_ids), total)
+    _append_batch(batch, item_ids, item_types, columns)
+    progress("reading", len(item_ids), len(item_ids))
+    return item_ids, item_types, columns
+
+
+def _append_batch(
+    batch: list[dict[str, Any]],
+    item_ids: list[str],
+    item_types: list[str],
+    columns: dict[str, list],
+):
+    if not batch:
+        return
+    item_ids.extend(document["_id"] for document in batch)
+    item_types.extend(document["type"] for document in batch)
+    for feature, values in item_columns(batch).items():
+        columns.setdefault(feature, []).extend(values)
+
+
+def fit_vectorizer(texts: list[str]) -> tuple[TfidfVectorizer, csr_matrix]:
+    vectorizer = TfidfVectorizer(stop_words="english")
+    return vectorizer, vectorizer.fit_transform(texts)
+
+
+def fit_scaler(values: list[float]) -> tuple[MinMaxScaler, np.ndarray]:
+    column = np.array(values, dtype=np.float64).reshape(-1, 1)
+    scaler = MinMaxScaler().fit(column[~np.isnan(column.flatten())])
+    return scaler, scale_column(values, scaler)
+
+
+def fit_features(
+    columns: dict[str, list], n_jobs: int | None = None
+) -> tuple[dict[str, Any], dict[str, TfidfVectorizer], MinMaxScaler, MinMaxScaler]:
+    n_jobs = n_jobs or os.cpu_count() or 1
+    item_vectors: dict[str, Any] = {}
+    vectorizers: dict[str, TfidfVectorizer] = {}
+    # The four vectorizers are independent, so each one is fitted in its own
+    # process while the scalers are fitted here
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(TEXT_FEATURES))) as pool:
+        futures = {
+            feature: pool.submit(fit_vectorizer, columns[feature])
+            for feature in TEXT_FEATURES
+        }
+        date_scaler, item_vectors["release_date"] = fit_scaler(columns["release_date"])
+        runtime_scaler, item_vectors["pages_runtime"] = fit_scaler(
+            columns["pages_runtime"]
+        )
+        for feature, future in futures.items():
+            vectorizers[feature], item_vectors[feature] = future.result()
+    return item_vectors, vectorizers, date_scaler, runtime_scaler
+
+
+def project(
+    weighted: csr_matrix,
+    projection: GaussianRandomProjection,
+    chunk_size: int = 50_000,
+    progress: Progress = log_progress,
+) -> np.ndarray:
+    projection.fit(weighted[:1])
+    reduced = np.empty((weighted.shape[0], projection.n_components), dtype=np.float32)
+    for start in range(0, weighted.shape[0], chunk_size):
+        end = min(start + chunk_size, weighted.shape[0])
+        reduced[start:end] = projection.transform(weighted[start:end])
+        progress("projecting", end, weighted.shape[0])
+    return reduced
+
+
+def is_artifact_stale(
+    vector_dir: str, weights: dict[str, float], n_components: int, seed: int
+) -> bool:
+    manifest = read_manifest(os.path.join(vector_dir, ARTIFACT_DIR))
+    return (
+        manifest is None
+        or manifest["version"] != ARTIFACT_VERSION
+        or manifest["n_components"] != n_components
+        or manifest["seed"] != seed
+        or manifest["weights"] != weights
+    )
+
+
+def load_features(vector_dir: str) -> dict[str, Any] | None:
+    features_path = os.path.join(vector_dir, FEATURES_FILE)
+    if not os.path.exists(features_path):
+        return None
+    features = joblib.load(features_path)
+    if not isinstance(features, dict) or features["version"] != FEATURES_VERSION:
+        logger.info(f"Ignoring outdated features file {features_path}")
+        return None
+    # Compaction publishes writes into the artifact but never into the
+    # features, so they only still describe the items if the artifact on
+    # disk is the one built from them
+    manifest = read_manifest(os.path.join(vector_dir, ARTIFACT_DIR))
+    if (
+        manifest is None
+        or manifest.get("read_at") != features["read_at"]
+        or manifest["n_items"] != len(features["item_ids"])
+    ):
+        logger.info(f"Items changed since {features_path} was written, refitting")
+        return None
+    return features
+
+
+def compute_features(
+    collection: Collection,
+    vector_dir: str,
+    batch_size: int = 10_000,
+    n_jobs: int | None = None,
+    progress: Progress = log_progress,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    read_at = datetime.now(timezone.utc)
+    item_ids, item_types, columns = stream_columns(collection, batch_size, progress)
+    logger.debug(
+        f"Aggregated {len(item_ids)} items from MongoDB in {time.perf_counter() - start:.1f}s"
+    )
+    item_vectors, vectorizers, date_scaler, runtime_scaler = fit_features(
+        columns, n_jobs
+    )
+    features = {
+        "version": FEATURES_VERSION,
+        "item_vectors": item_vectors,
+        "vectorizers": vectorizers,
+        "item_ids": item_ids,
+        "item_types": item_types,
+        "date_scaler": date_scaler,
+        "runtime_scaler": runtime_scaler,
+        "read_at": read_at.isoformat(),
+    }
+    features_path = os.path.join(vector_dir, FEATURES_FILE)
+    joblib.dump(features, features_path)
+    logger.info(
+        f"Vectors computed and saved to {features_path} in {time.perf_counter() - start:.1f}s"
+    )
+    return features
+
+
+def catch_up(
+    collection: Collection,
+    read_at: str,
+    encoder: ItemEncoder,
+    reduced_vectors: np.ndarray,
+    item_ids: list[str],
+    item_types: list[str],
+    batch_size: int = 10_000,
+) -> tuple[np.ndarray, list[str], list[str], int]:
+    # Writes made while the build read and fitted may meanwhile have been
+    # compacted into the artifact it replaces, leaving no worker to replay
+    # them, so items written since are re-encoded and deleted ones dropped
+    since = datetime.fromisoformat(read_at) - CATCH_UP_MARGIN
+    live = {
+        document["_id"]
+        for document in collection.find({}, {"_id": 1}, batch_size=batch_size)
+    }
+    changed = list(
+        collection.find(
+            {"updated_at": {"$gte": since}},
+            {field: 1 for field in PROJECTED_FIELDS},
+            batch_size=batch_size,
+        )
+    )
+    changed_ids = {document["_id"] for document in changed}
+    keep = [
+        row
+        for row, item_id in enumerate(item_ids)
+        if item_id in live and item_id not in changed_ids
+    ]
+    n_changes = len(item_ids) - len(keep) + len(changed)
+    if n_changes == 0:
+        return reduced_vectors, item_ids, item_types, 0
+    vectors = reduced_vectors[keep]
+    ids = [item_ids[row] for row in keep]
+    types = [item_types[row] for row in keep]
+    if changed:
+        vectors = np.vstack([vectors, encoder.encode(changed).astype(vectors.dtype)])
+        ids += [document["_id"] for document in changed]
+        types += [document["type"] for document in changed]
+    return vectors, ids, types, n_changes
+
+
+def build_vectors(
+    collection: Collection,
+    vector_dir: str,
+    weights: dict[str, float],
+    n_components: int,
+    seed: int,
+    reuse_features: bool = True,
+    batch_size: int = 10_000,
+    n_jobs: int | None = None,
+    ann_lists: int | None = None,
+    ann_nprobe: int = 8,
+    feature_blocks: bool = False,
+    quantization: str | None = None,
+    progress: Progress = log_progress,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    os.makedirs(vector_dir, exist_ok=True)
+    features = load_features(vector_dir) if reuse_features else None
+    if features is None:
+        features = compute_features(
+            collection, vector_dir, batch_size, n_jobs, progress
+        )
+    projection = GaussianRandomProjection(n_components=n_components, random_state=seed)
+    reduced_vectors = project(
+        weight_features(features["item_vectors"], weights),
+        projection,
+        progress=progress,
+    )
+    encoder = ItemEncoder(
+        features["vectorizers"],
+        features["date_scaler"],
+        features["runtime_scaler"],
+        projection,
+        weights,
+    )
+    artifact_path = os.path.join(vector_dir, ARTIFACT_DIR)
+    with artifact_lock(vector_dir):
+        reduced_vectors, item_ids, item_types, n_changes = catch_up(
+            collection,
+            features["read_at"],
+            encoder,
+            reduced_vectors,
+            features["item_ids"],
+            features["item_types"],
+            batch_size,
+        )
+        if n_changes:
+            logger.info(f"Caught up on {n_changes} items written during the build")
+        manifest = save_artifact(
+            artifact_path,
+            reduced_vectors,
+            item_ids,
+            item_types,
+            encoder,
+            ann_lists=ann_lists,
+            ann_nprobe=ann_nprobe,
+            build_seconds=time.perf_counter() - start,
+            quantization=quantization,
+            # The features no longer describe a caught up artifact
+            read_at=None if n_changes else features["read_at"],
+        )
+    logger.info(
+        f"Vector artifact saved to {artifact_path} in {time.perf_counter() - start:.1f}s"
+    )
+    if "ann" in manifest:
+        logger.info(
+            f"ANN index with {manifest['ann']['n_lists']} lists, recall@10 {manifest['ann']['recall_at_10']:.3f} at nprobe {ann_nprobe}"
+        )
+    if "quantization" in manifest:
+        quantization = manifest["quantization"]
+        logger.info(
+            f"{quantization['mode']} vectors save {quantization['saved_bytes'] / 2**20:.1f}MB, recall@10 {quantization['coarse_recall_at_10']:.3f} before and {quantization['recall_at_10']:.3f} after reranking {quantization['rerank']}"
+        )
+    if feature_blocks:
+        blocks_manifest = build_feature_blocks(
+            os.path.join(vector_dir, BLOCKS_DIR),
+            features["item_vectors"],
+            weights,
+            projection,
+            features["item_ids"],
+            features["item_types"],
+            fitted_at=manifest["fitted_at"],
+        )
+        logger.info(
+            f"Feature blocks for {blocks_manifest['features']} saved in {time.perf_counter() - start:.1f}s"
+        )
+    return manifest
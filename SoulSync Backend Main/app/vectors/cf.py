@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+from pymongo.collection import Collection
+from scipy.sparse import csr_matrix
+
+from app.vectors.build import Progress, log_progress
+from app.vectors.versions import new_version, publish_version, resolve_version
+
+CF_DIR = "cf"
+MANIFEST_FILE = "manifest.json"
+IDS_FILE = "ids.npy"
+INDPTR_FILE = "indptr.npy"
+INDICES_FILE = "indices.npy"
+COUNTS_FILE = "counts.npy"
+ITEM_COUNTS_FILE = "item_counts.npy"
+
+
+def stream_likes(
+    collection: Collection,
+    batch_size: int = 100_000,
+    progress: Progress = log_progress,
+) -> tuple[csr_matrix, list[str]]:
+    # Binary user x item matrix of likes; ids are interned as they stream in
+    user_index: dict[str, int] = {}
+    item_index: dict[str, int] = {}
+    users = array("i")
+    items = array("i")
+    cursor = collection.find(
+        {"preference": "like"},
+        {"_id": 0, "user_id": 1, "media_item_id": 1},
+        batch_size=batch_size,
+    )
+    for document in cursor:
+        users.append(user_index.setdefault(document["user_id"], len(user_index)))
+        items.append(item_index.setdefault(document["media_item_id"], len(item_index)))
+        if len(users) % batch_size == 0:
+            progress("likes", len(users), len(users))
+    progress("likes", len(users), len(users))
+    likes = csr_matrix(
+        (
+            np.ones(len(users), dtype=np.float32),
+            (
+                np.frombuffer(users, dtype=np.int32),
+                np.frombuffer(items, dtype=np.int32),
+            ),
+        ),
+        shape=(len(user_index), len(item_index)),
+    )
+    return likes, list(item_index)
+
+
+def cooccurrence_top_k(
+    likes: csr_matrix,
+    k: int = 100,
+    block_size: int = 10_000,
+    progress: Progress = log_progress,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Item x item co-like counts, computed one block of items at a time and
+    # pruned to each item's k strongest pairs, as CSR arrays
+    likes = likes.tocsr()
+    likes.data[:] = 1
+    item_users = likes.T.tocsr()
+    n_items = likes.shape[1]
+    indptr = np.zeros(n_items + 1, dtype=np.int64)
+    indices: list[np.ndarray] = []
+    counts: list[np.ndarray] = []
+    for start in range(0, n_items, block_size):
+        block = (item_users[start : start + block_size] @ likes).tocsr()
+        for row in range(block.shape[0]):
+            lo, hi = block.indptr[row], block.indptr[row + 1]
+            columns = block.indices[lo:hi]
+            values = block.data[lo:hi]
+            keep = columns != start + row
+            columns, values = columns[keep], values[keep]
+            if len(columns) > k:
+                top = np.argpartition(values, -k)[-k:]
+                columns, values = columns[top], values[top]
+            indices.append(columns.astype(np.int32))
+            counts.append(values.astype(np.float32))
+            indptr[start + row + 1] = indptr[start + row] + len(columns)
+        progress("co-occurrence", min(start + block_size, n_items), n_items)
+    return (
+        indptr,
+        np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+        np.concatenate(counts) if counts else np.empty(0, dtype=np.float32),
+    )
+
+
+def build_cf(
+    collection: Collection,
+    path: str,
+    k: int = 100,
+    block_size: int = 10_000,
+    progress: Progress = log_progress,
+) -> dict[str, Any]:
+    likes, item_ids = stream_likes(collection, progress=progress)
+    indptr, indices, counts = cooccurrence_top_k(likes, k, block_size, progress)
+    version_path = new_version(path)
+    np.save(os.path.join(version_path, IDS_FILE), np.asarray(item_ids, dtype=str))
+    np.save(os.path.join(version_path, INDPTR_FILE), indptr)
+    np.save(os.path.join(version_path, INDICES_FILE), indices)
+    np.save(os.path.join(version_path, COUNTS_FILE), counts)
+    np.save(
+        os.path.join(version_path, ITEM_COUNTS_FILE),
+        np.asarray(likes.sum(axis=0), dtype=np.float32).ravel(),
+    )
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "n_users": int(likes.shape[0]),
+        "n_items": int(likes.shape[1]),
+        "n_likes": int(likes.nnz),
+        "n_pairs": int(len(indices)),
+        "k": k,
+    }
+    with open(os.path.join(version_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    publish_version(path, version_path)
+    return manifest
+
+
+class CFModel:
+    # Item-item collaborative filtering: an item's score for a user is its
+    # cosine co-like similarity summed over the items the user liked.
+    # Likes after the build are kept as an in-memory delta on top of the
+    # memory mapped co-occurrence table.
+    def __init__(
+        self,
+        manifest: dict[str, Any],
+        item_ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        counts: np.ndarray,
+        item_counts: np.ndarray,
+    ):
+        self.manifest = manifest
+        self.item_ids = item_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.item_counts = item_counts
+        self.id_to_index: dict[str, int] = {
+            item_id: index for index, item_id in enumerate(item_ids.tolist())
+        }
+        self.delta: dict[str, Counter[str]] = {}
+        self.count_delta: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "CFModel | None":
+        path = resolve_version(path)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return cls(
+            manifest,
+            *(
+                np.load(os.path.join(path, file), mmap_mode=mmap_mode)
+                for file in (
+                    IDS_FILE,
+                    INDPTR_FILE,
+                    INDICES_FILE,
+                    COUNTS_FILE,
+                    ITEM_COUNTS_FILE,
+                )
+            ),
+        )
+
+    def update(self, item_id: str, liked_ids: list[str], sign: int):
+        # sign is +1 when the user starts liking item_id, -1 when they stop
+        with self._lock:
+            pairs = self.delta.setdefault(item_id, Counter())
+            for other_id in liked_ids:
+                if other_id == item_id:
+                    continue
+                pairs[other_id] += sign
+                self.delta.setdefault(other_id, Counter())[item_id] += sign
+            self.count_delta[item_id] += sign
+
+    def _item_count(self, item_id: str) -> float:
+        index = self.id_to_index.get(item_id)
+        base = 0.0 if index is None else float(self.item_counts[index])
+        return base + self.count_delta.get(item_id, 0)
+
+    def score(self, liked_ids: list[str]) -> tuple[list[str], np.ndarray]:
+        n_base = len(self.item_ids)
+        base_ids = [item_id for item_id in liked_ids if item_id in self.id_to_index]
+        base_liked = np.asarray(
+            [self.id_to_index[item_id] for item_id in base_ids], dtype=np.intp
+        )
+        if len(base_liked) == 0 and not self.delta:
+            return [], np.empty(0)
+        starts = self.indptr[base_liked]
+        lengths = self.indptr[base_liked + 1] - starts
+        # Gather every liked item's row in one go
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        columns = np.asarray(self.indices[positions], dtype=np.intp)
+        extra_ids: dict[str, int] = {}
+        with self._lock:
+            liked_counts = np.asarray(self.item_counts[base_liked], dtype=np.float64)
+            if self.count_delta:
+                liked_counts += [self.count_delta.get(i, 0) for i in base_ids]
+            weights = np.asarray(self.counts[positions], dtype=np.float64) / np.repeat(
+                np.sqrt(np.maximum(liked_counts, 1)), lengths
+            )
+            delta_columns: list[int] = []
+            delta_weights: list[float] = []
+            for item_id in liked_ids:
+                pairs = self.delta.get(item_id)
+                if not pairs:
+                    continue
+                norm = np.sqrt(max(self._item_count(item_id), 1))
+                for other_id, count in pairs.items():
+                    index = self.id_to_index.get(other_id)
+                    if index is None:
+                        index = n_base + extra_ids.setdefault(other_id, len(extra_ids))
+                    delta_columns.append(index)
+                    delta_weights.append(count / norm)
+            columns = np.concatenate([columns, np.asarray(delta_columns, np.intp)])
+            weights = np.concatenate(
+                [weights, np.asarray(delta_weights, dtype=np.float64)]
+            )
+            # Nothing liked, or only items nobody co-liked
+            if len(columns) == 0:
+                return [], np.empty(0)
+            candidates, inverse = np.unique(columns, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights, minlength=len(candidates))
+            in_base = candidates < n_base
+            extra = list(extra_ids)
+            ids = self.item_ids[candidates[in_base]].tolist() + [
+                extra[c - n_base] for c in candidates[~in_base]
+            ]
+            item_counts = np.zeros(len(candidates))
+            item_counts[in_base] = self.item_counts[candidates[in_base]]
+            if self.count_delta:
+                item_counts += [self.count_delta.get(item_id, 0) for item_id in ids]
+        scores /= np.sqrt(np.maximum(item_counts, 1))
+        positive = np.flatnonzero(scores > 0)
+        return [ids[i] for i in positive], scores[positive]
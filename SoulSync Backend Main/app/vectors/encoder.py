@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.random_projection import GaussianRandomProjection
+
+from app.vectors.scoring import normalize_rows
+
+TEXT_FEATURES = ["title", "description", "creator", "genres"]
+
+
+def scale_column(values: list[float], scaler: MinMaxScaler) -> np.ndarray:
+    column = np.array(values, dtype=np.float64).reshape(-1, 1)
+    mask = ~np.isnan(column.flatten())
+    scaled = np.zeros(column.shape)
+    if mask.any():
+        scaled[mask] = scaler.transform(column[mask])
+    return scaled
+
+
+def weight_features(features: dict[str, Any], weights: dict[str, float]) -> csr_matrix:
+    # Order follows the weights so the columns line up with the projection
+    weighted_vectors = []
+    for feature, weight in weights.items():
+        if feature in features:
+            feature_vector = features[feature]
+            if not sparse.issparse(feature_vector):
+                feature_vector = csr_matrix(feature_vector)
+            weighted_vectors.append(feature_vector * weight)
+    return sparse.hstack(weighted_vectors).tocsr()
+
+
+def item_columns(items: list[dict[str, Any]]) -> dict[str, list]:
+    return {
+        "title": [item["title"] for item in items],
+        "description": [item["description"] for item in items],
+        "creator": [item["creator"] for item in items],
+        "genres": [" ".join(item["genres"]) for item in items],
+        "release_date": [
+            (
+                item["release_date"].timestamp()
+                if isinstance(item.get("release_date"), datetime)
+                else np.nan
+            )
+            for item in items
+        ],
+        "pages_runtime": [
+            (np.nan if item.get("pages_runtime") is None else item["pages_runtime"])
+            for item in items
+        ],
+    }
+
+
+# Everything fitted during a build, so items written after the build can be
+# embedded into the same space as the serving matrix
+class ItemEncoder:
+    def __init__(
+        self,
+        vectorizers: dict[str, TfidfVectorizer],
+        date_scaler: MinMaxScaler,
+        runtime_scaler: MinMaxScaler,
+        projection: GaussianRandomProjection,
+        weights: dict[str, float],
+    ):
+        self.vectorizers = vectorizers
+        self.date_scaler = date_scaler
+        self.runtime_scaler = runtime_scaler
+        self.projection = projection
+        self.weights = weights
+
+    def transform(self, columns: dict[str, list]) -> dict[str, Any]:
+        features: dict[str, Any] = {
+            feature: self.vectorizers[feature].transform(columns[feature])
+            for feature in TEXT_FEATURES
+        }
+        features["release_date"] = scale_column(
+            columns["release_date"], self.date_scaler
+        )
+        features["pages_runtime"] = scale_column(
+            columns["pages_runtime"], self.runtime_scaler
+        )
+        return features
+
+    def encode(self, items: list[dict[str, Any]]) -> np.ndarray:
+        weighted = weight_features(self.transform(item_columns(items)), self.weights)
+        return normalize_rows(self.projection.transform(weighted))
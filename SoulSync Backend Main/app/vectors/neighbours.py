@@ -0,0 +1,137 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+
+from app.vectors.artifact import IDS_FILE, VECTORS_FILE, VectorArtifact
+from app.vectors.build import Progress, log_progress
+from app.vectors.store import BATCH_SCORES_BUDGET
+from app.vectors.versions import new_version, publish_version, resolve_version
+
+NEIGHBOURS_DIR = "neighbours"
+MANIFEST_FILE = "manifest.json"
+INDICES_FILE = "indices.npy"
+SCORES_FILE = "scores.npy"
+
+_vectors: np.ndarray | None = None
+
+
+def _init_worker(vectors_path: str):
+    # Every worker maps the artifact instead of receiving a pickled copy
+    global _vectors
+    _vectors = np.load(vectors_path, mmap_mode="r")
+
+
+def neighbour_block(
+    start: int, stop: int, k: int, vectors: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    vectors = _vectors if vectors is None else vectors
+    scores = np.asarray(vectors[start:stop]) @ np.asarray(vectors).T
+    # An item is not its own neighbour
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    k = min(k, scores.shape[1] - 1)
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return (
+        np.take_along_axis(top, order, axis=1).astype(np.int32),
+        np.take_along_axis(top_scores, order, axis=1).astype(np.float16),
+    )
+
+
+def build_neighbours(
+    artifact: VectorArtifact,
+    path: str,
+    k: int = 50,
+    block_size: int | None = None,
+    n_jobs: int | None = None,
+    progress: Progress = log_progress,
+) -> dict[str, Any]:
+    # Indices point into the artifact's ids, which are copied alongside, so
+    # the table stays valid when the artifact is compacted or rewritten
+    n_items = len(artifact.item_ids)
+    k = min(k, n_items - 1)
+    block_size = block_size or max(1, BATCH_SCORES_BUDGET // max(1, n_items))
+    version_path = new_version(path)
+    indices = np.lib.format.open_memmap(
+        os.path.join(version_path, INDICES_FILE), "w+", np.int32, (n_items, k)
+    )
+    scores = np.lib.format.open_memmap(
+        os.path.join(version_path, SCORES_FILE), "w+", np.float16, (n_items, k)
+    )
+    starts = list(range(0, n_items, block_size))
+    with ProcessPoolExecutor(
+        n_jobs,
+        initializer=_init_worker,
+        initargs=(os.path.join(artifact.path, VECTORS_FILE),),
+    ) as pool:
+        blocks = pool.map(
+            neighbour_block,
+            starts,
+            [min(start + block_size, n_items) for start in starts],
+            [k] * len(starts),
+        )
+        for i, (start, (block_indices, block_scores)) in enumerate(zip(starts, blocks)):
+            indices[start : start + len(block_indices)] = block_indices
+            scores[start : start + len(block_scores)] = block_scores
+            progress("neighbours", i + 1, len(starts))
+    indices.flush()
+    scores.flush()
+    del indices, scores
+    np.save(os.path.join(version_path, IDS_FILE), np.asarray(artifact.item_ids))
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "artifact": artifact.manifest["created_at"],
+        # Neighbours only hold in the vector space of the same fit
+        "fitted_at": artifact.manifest.get("fitted_at"),
+        "n_items": n_items,
+        "k": k,
+    }
+    with open(os.path.join(version_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    publish_version(path, version_path)
+    return manifest
+
+
+class NeighbourTable:
+    def __init__(
+        self,
+        manifest: dict[str, Any],
+        item_ids: np.ndarray,
+        indices: np.ndarray,
+        scores: np.ndarray,
+    ):
+        self.manifest = manifest
+        self.item_ids = item_ids
+        self.indices = indices
+        self.scores = scores
+        self.id_to_row: dict[str, int] = {
+            item_id: row for row, item_id in enumerate(item_ids.tolist())
+        }
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "NeighbourTable | None":
+        path = resolve_version(path)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return cls(
+            manifest,
+            np.load(os.path.join(path, IDS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, INDICES_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, SCORES_FILE), mmap_mode=mmap_mode),
+        )
+
+    def neighbours(self, item_id: str) -> list[tuple[str, float]] | None:
+        row = self.id_to_row.get(item_id)
+        if row is None:
+            return None
+        return [
+            (str(self.item_ids[index]), float(score))
+            for index, score in zip(self.indices[row], self.scores[row])
+        ]
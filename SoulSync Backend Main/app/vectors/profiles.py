@@ -0,0 +1,117 @@
+from typing import Any
+
+import numpy as np
+
+LIKE = "like"
+DISLIKE = "dislike"
+
+
+class ProfileVectors:
+    # Running sums and counts of a user's liked and disliked item vectors per
+    # media type, so a profile is read without touching the preferences.
+    # Shared profiles are never changed in place: writers update a copy and
+    # publish it, so scoring can read one without a lock.
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.sums: dict[tuple[str, str], np.ndarray] = {}
+        self.counts: dict[tuple[str, str], int] = {}
+        # item id -> (type, preference) of every rated item in the store
+        self.rated: dict[str, tuple[str, str]] = {}
+        # item id -> the vector it added, which is what removing it takes
+        # back out even if the item was re-encoded since
+        self.contributions: dict[str, np.ndarray] = {}
+
+    def copy(self) -> "ProfileVectors":
+        profile = ProfileVectors(self.dim)
+        profile.sums = {key: vector.copy() for key, vector in self.sums.items()}
+        profile.counts = dict(self.counts)
+        profile.rated = dict(self.rated)
+        # Contributions are replaced, never modified, so they can be shared
+        profile.contributions = dict(self.contributions)
+        return profile
+
+    def add(self, item_id: str, item_type: str, preference: str, vector: np.ndarray):
+        self.remove(item_id)
+        key = (item_type, preference)
+        if key not in self.sums:
+            self.sums[key] = np.zeros(self.dim, dtype=np.float64)
+            self.counts[key] = 0
+        vector = np.array(vector, dtype=np.float32)
+        self.sums[key] += vector
+        self.counts[key] += 1
+        self.rated[item_id] = key
+        self.contributions[item_id] = vector
+
+    def remove(self, item_id: str):
+        key = self.rated.pop(item_id, None)
+        if key is None:
+            return
+        self.sums[key] -= self.contributions.pop(item_id)
+        self.counts[key] -= 1
+
+    def _mean(self, item_type: str | None, preference: str) -> np.ndarray | None:
+        keys = [
+            key
+            for key in self.sums
+            if key[1] == preference and (item_type is None or key[0] == item_type)
+        ]
+        count = sum(self.counts[key] for key in keys)
+        if count <= 0:
+            return None
+        return sum(self.sums[key] for key in keys) / count
+
+    def vector(self, item_type: str | None = None) -> np.ndarray | None:
+        liked = self._mean(item_type, LIKE)
+        if liked is None:
+            return None
+        disliked = self._mean(item_type, DISLIKE)
+        return liked if disliked is None else liked - 0.5 * disliked
+
+    def rated_ids(
+        self, item_type: str | None = None, preference: str | None = None
+    ) -> list[str]:
+        return [
+            item_id
+            for item_id, (rated_type, rated_preference) in self.rated.items()
+            if (item_type is None or rated_type == item_type)
+            and (preference is None or rated_preference == preference)
+        ]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "dim": self.dim,
+            "sums": [
+                {
+                    "type": item_type,
+                    "preference": preference,
+                    "count": self.counts[(item_type, preference)],
+                    "sum": vector.tobytes(),
+                }
+                for (item_type, preference), vector in self.sums.items()
+            ],
+            "rated": [
+                [item_id, item_type, preference]
+                for item_id, (item_type, preference) in self.rated.items()
+            ],
+            # float32 rows in the order of "rated"
+            "contributions": b"".join(
+                self.contributions[item_id].tobytes() for item_id in self.rated
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ProfileVectors":
+        profile = cls(data["dim"])
+        for entry in data["sums"]:
+            key = (entry["type"], entry["preference"])
+            profile.sums[key] = np.frombuffer(entry["sum"], dtype=np.float64).copy()
+            profile.counts[key] = entry["count"]
+        profile.rated = {
+            item_id: (item_type, preference)
+            for item_id, item_type, preference in data["rated"]
+        }
+        contributions = np.frombuffer(data["contributions"], dtype=np.float32).reshape(
+            len(profile.rated), profile.dim
+        )
+        profile.contributions = dict(zip(profile.rated, contributions))
+        return profile
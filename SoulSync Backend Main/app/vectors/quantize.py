@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+from app.vectors.ann import recall_at_k
+from app.vectors.scoring import top_k
+
+QUANTIZED_FILE = "quantized.npy"
+SCALES_FILE = "quantized_scales.npy"
+MODES = ("float16", "int8")
+
+
+class QuantizedVectors:
+    # Compact copy of the artifact matrix for the coarse pass of exact search:
+    # float16, or int8 codes with one scale per row. The full precision matrix
+    # stays memory mapped and is only read for the candidates being reranked.
+    def __init__(self, codes: np.ndarray, scales: np.ndarray | None = None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def mode(self) -> str:
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    @classmethod
+    def build(
+        cls, vectors: np.ndarray, mode: str, chunk_size: int = 100_000
+    ) -> "QuantizedVectors":
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization {mode}, expected one of {MODES}")
+        if mode == "float16":
+            return cls(np.asarray(vectors, dtype=np.float16))
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], chunk_size):
+            chunk = np.asarray(vectors[start : start + chunk_size], dtype=np.float32)
+            chunk_scales = np.abs(chunk).max(axis=1) / 127
+            chunk_scales[chunk_scales == 0] = 1
+            codes[start : start + len(chunk)] = np.round(
+                chunk / chunk_scales[:, None]
+            ).astype(np.int8)
+            scales[start : start + len(chunk)] = chunk_scales
+        return cls(codes, scales)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, QUANTIZED_FILE), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(path, SCALES_FILE), self.scales)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "QuantizedVectors | None":
+        if not os.path.exists(os.path.join(path, QUANTIZED_FILE)):
+            return None
+        scales_path = os.path.join(path, SCALES_FILE)
+        return cls(
+            np.load(os.path.join(path, QUANTIZED_FILE), mmap_mode=mmap_mode),
+            np.load(scales_path) if os.path.exists(scales_path) else None,
+        )
+
+    def score(
+        self,
+        query: np.ndarray,
+        rows: slice | np.ndarray | None = None,
+        chunk_size: int = 65_536,
+    ) -> np.ndarray:
+        # Chunked, so the float32 copy of the codes never exceeds one chunk
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], chunk_size):
+            chunk = np.asarray(codes[start : start + chunk_size], dtype=np.float32)
+            scores[start : start + len(chunk)] = chunk @ query
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+
+def evaluate_quantized_recall(
+    vectors: np.ndarray,
+    quantized: QuantizedVectors,
+    rerank: int,
+    k: int = 10,
+    n_queries: int = 200,
+    seed: int = 42,
+) -> dict[str, float]:
+    # Recall of the coarse pass on its own and after the exact rerank, with
+    # items as queries as in evaluate_recall
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(vectors.shape[0], min(n_queries, vectors.shape[0]))]
+    coarse_recalls, reranked_recalls = [], []
+    for query in np.asarray(queries, dtype=np.float32):
+        exact, _ = top_k(vectors @ query, k)
+        coarse, _ = top_k(quantized.score(query), max(k, rerank))
+        local, _ = top_k(np.asarray(vectors[np.sort(coarse)]) @ query, k)
+        coarse_recalls.append(recall_at_k(exact, coarse[:k]))
+        reranked_recalls.append(recall_at_k(exact, np.sort(coarse)[local]))
+    return {
+        "coarse_recall_at_10": float(np.mean(coarse_recalls)),
+        "recall_at_10": float(np.mean(reranked_recalls)),
+    }
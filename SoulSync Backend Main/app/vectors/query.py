@@ -0,0 +1,60 @@
+from bisect import bisect_left
+from difflib import get_close_matches
+
+import numpy as np
+
+from app.vectors.encoder import TEXT_FEATURES, ItemEncoder, weight_features
+from app.vectors.scoring import normalize_rows
+
+
+class QueryEncoder:
+    # Embeds free text into the item space with the fitted vectorizers and
+    # projection. Words outside a vectorizer's vocabulary are replaced by the
+    # terms they prefix, or failing that by close spellings.
+    def __init__(self, encoder: ItemEncoder, max_expansions: int = 5):
+        self.encoder = encoder
+        self.max_expansions = max_expansions
+        self.vocabularies = {
+            feature: sorted(encoder.vectorizers[feature].vocabulary_)
+            for feature in TEXT_FEATURES
+        }
+        self.analyzers = {
+            feature: encoder.vectorizers[feature].build_analyzer()
+            for feature in TEXT_FEATURES
+        }
+
+    def expand(self, feature: str, word: str) -> list[str]:
+        vocabulary = self.vocabularies[feature]
+        start = bisect_left(vocabulary, word)
+        completions = [
+            term
+            for term in vocabulary[start : start + self.max_expansions]
+            if term.startswith(word)
+        ]
+        if completions:
+            return completions
+        # Only terms with the same first letter are compared, which keeps
+        # the edit distance scan to a small slice of the vocabulary
+        start = bisect_left(vocabulary, word[0])
+        end = bisect_left(vocabulary, chr(ord(word[0]) + 1))
+        return get_close_matches(word, vocabulary[start:end], n=3, cutoff=0.75)
+
+    def _terms(self, feature: str, query: str) -> str:
+        vocabulary = self.encoder.vectorizers[feature].vocabulary_
+        terms: list[str] = []
+        for word in self.analyzers[feature](query):
+            terms.extend([word] if word in vocabulary else self.expand(feature, word))
+        return " ".join(terms)
+
+    def encode(self, query: str) -> np.ndarray | None:
+        columns: dict[str, list] = {
+            feature: [self._terms(feature, query)] for feature in TEXT_FEATURES
+        }
+        # Dates and lengths have no say in a text query
+        columns["release_date"] = [np.nan]
+        columns["pages_runtime"] = [np.nan]
+        features = self.encoder.transform(columns)
+        if all(features[feature].nnz == 0 for feature in TEXT_FEATURES):
+            return None
+        weighted = weight_features(features, self.encoder.weights)
+        return normalize_rows(self.encoder.projection.transform(weighted))[0]
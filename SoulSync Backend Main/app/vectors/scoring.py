@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Below this many rows splitting the product across threads costs more than
+# it saves
+MIN_ROWS_PER_THREAD = 50_000
+
+# One pool per thread count for the whole process. Stores are replaced on
+# every reload and compaction, and a request may still be scoring the old
+# one, so engines share pools rather than each owning one.
+_executors: dict[int, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def shared_executor(n_threads: int) -> ThreadPoolExecutor:
+    with _executors_lock:
+        if n_threads not in _executors:
+            _executors[n_threads] = ThreadPoolExecutor(
+                n_threads, thread_name_prefix="scoring"
+            )
+        return _executors[n_threads]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(
+    scores: np.ndarray, k: int, exclude: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    if exclude is not None and len(exclude) > 0:
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=scores.dtype)
+    indices = np.argpartition(scores, -k)[-k:]
+    indices = indices[np.argsort(scores[indices])[::-1]]
+    indices = indices[np.isfinite(scores[indices])]
+    return indices, scores[indices]
+
+
+class ScoringEngine:
+    def __init__(
+        self, vectors: np.ndarray, normalized: bool = False, n_threads: int = 1
+    ):
+        # Rows are unit length once, here, so cosine similarity is a single
+        # matrix-vector product per request
+        self.vectors = (
+            vectors
+            if normalized and vectors.dtype == np.float32
+            else normalize_rows(vectors)
+        )
+        self.n_threads = max(1, n_threads)
+        self._executor = shared_executor(self.n_threads) if self.n_threads > 1 else None
+
+    def normalize_query(self, query: np.ndarray) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def score(
+        self, query: np.ndarray, rows: np.ndarray | slice | None = None
+    ) -> np.ndarray:
+        query = self.normalize_query(query)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        n_rows = vectors.shape[0]
+        if self._executor is None or n_rows < MIN_ROWS_PER_THREAD * 2:
+            return vectors @ query
+        # numpy releases the GIL inside matmul, so row chunks run in parallel
+        scores = np.empty(n_rows, dtype=np.float32)
+        bounds = np.linspace(0, n_rows, self.n_threads + 1, dtype=int)
+
+        def score_chunk(start: int, end: int):
+            np.matmul(vectors[start:end], query, out=scores[start:end])
+
+        list(self._executor.map(score_chunk, bounds[:-1], bounds[1:]))
+        return scores
+
+    def score_batch(
+        self, queries: np.ndarray, rows: np.ndarray | slice | None = None
+    ) -> np.ndarray:
+        # One GEMM for many queries; the result has one column per query
+        queries = normalize_rows(queries)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return vectors @ queries.T
+
+    def top_k(
+        self,
+        query: np.ndarray,
+        k: int,
+        rows: np.ndarray | slice | None = None,
+        exclude: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return top_k(self.score(query, rows), k, exclude)
@@ -0,0 +1,354 @@
+import threading
+import time
+
+import numpy as np
+
+from app.vectors.ann import IVFIndex
+from app.vectors.quantize import QuantizedVectors
+from app.vectors.scoring import ScoringEngine, normalize_rows, top_k
+
+# Upper bound on the entries of one batch score matrix (128MB of float32)
+BATCH_SCORES_BUDGET = 2**25
+
+
+def partition_rows(item_types: np.ndarray) -> dict[str, slice | np.ndarray]:
+    partitions: dict[str, slice | np.ndarray] = {}
+    for item_type in np.unique(item_types):
+        rows = np.flatnonzero(item_types == item_type)
+        # Artifacts are sorted by type, so partitions are normally contiguous
+        # and can be served as zero copy views of the matrix
+        if rows[-1] - rows[0] + 1 == len(rows):
+            partitions[str(item_type)] = slice(int(rows[0]), int(rows[-1]) + 1)
+        else:
+            partitions[str(item_type)] = rows
+    return partitions
+
+
+class VectorStore:
+    # Rows from the artifact form the read-only base segment. Writes after the
+    # artifact was built are appended to an in-memory delta segment, and rows
+    # they replace are tombstoned until the next compaction.
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        item_ids: np.ndarray,
+        item_types: np.ndarray,
+        normalized: bool = True,
+        n_threads: int = 1,
+        ann: IVFIndex | None = None,
+        quantized: QuantizedVectors | None = None,
+        rerank: int = 200,
+    ):
+        self.scoring = ScoringEngine(
+            vectors, normalized=normalized, n_threads=n_threads
+        )
+        self.item_ids = item_ids
+        self.item_types = item_types
+        self.base_size = len(item_ids)
+        self.id_to_row: dict[str, int] = {
+            item_id: row for row, item_id in enumerate(item_ids.tolist())
+        }
+        self.partitions = partition_rows(item_types)
+        self.ann = ann
+        # Exact search then scores the compact copy and reranks the best
+        # rerank rows on the full precision matrix
+        self.quantized = quantized
+        self.rerank = rerank
+        self.delta_vectors = np.empty((16, vectors.shape[1]), dtype=np.float32)
+        self.delta_size = 0
+        self.delta_ids: list[str] = []
+        self.delta_types: list[str] = []
+        self.tombstones: set[int] = set()
+        self._tombstone_rows = np.empty(0, dtype=np.intp)
+        # Every write since the artifact was loaded, replayed onto the next
+        # artifact by compaction
+        self.log: list[tuple[str, str, str | None, np.ndarray | None]] = []
+        self.first_write_at: float | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.base_size + self.delta_size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.scoring.vectors
+
+    @property
+    def n_alive(self) -> int:
+        return len(self) - len(self.tombstones)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return len(self.tombstones) / max(1, len(self))
+
+    @property
+    def pending_age(self) -> float:
+        # Seconds since the oldest write in the log
+        if self.first_write_at is None:
+            return 0.0
+        return time.monotonic() - self.first_write_at
+
+    def _record(self, entry: tuple[str, str, str | None, np.ndarray | None]):
+        if not self.log:
+            self.first_write_at = time.monotonic()
+        self.log.append(entry)
+
+    def row_of(self, item_id: str) -> int | None:
+        return self.id_to_row.get(item_id)
+
+    def id_of(self, row: int) -> str:
+        if row < self.base_size:
+            return str(self.item_ids[row])
+        return self.delta_ids[row - self.base_size]
+
+    def type_of(self, row: int) -> str:
+        if row < self.base_size:
+            return str(self.item_types[row])
+        return self.delta_types[row - self.base_size]
+
+    def types_of(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.intp)
+        in_base = rows < self.base_size
+        types = np.empty(len(rows), dtype=self.item_types.dtype)
+        types[in_base] = self.item_types[rows[in_base]]
+        types[~in_base] = [
+            self.delta_types[row - self.base_size] for row in rows[~in_base]
+        ]
+        return types
+
+    def rows_of(self, item_ids: list[str], item_type: str | None = None) -> list[int]:
+        rows = [self.id_to_row.get(item_id) for item_id in item_ids]
+        return [
+            row
+            for row in rows
+            if row is not None and (item_type is None or self.type_of(row) == item_type)
+        ]
+
+    def get_vectors(self, rows: list[int] | np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.intp)
+        in_base = rows < self.base_size
+        if in_base.all():
+            return self.vectors[rows]
+        vectors = np.empty((len(rows), self.vectors.shape[1]), dtype=np.float32)
+        vectors[in_base] = self.vectors[rows[in_base]]
+        vectors[~in_base] = self.delta_vectors[rows[~in_base] - self.base_size]
+        return vectors
+
+    def partition(self, item_type: str | None) -> slice | np.ndarray | None:
+        if item_type is None:
+            return None
+        return self.partitions.get(item_type, np.empty(0, dtype=np.intp))
+
+    def upsert(self, item_id: str, item_type: str, vector: np.ndarray) -> None:
+        vector = normalize_rows(vector.reshape(1, -1))[0]
+        with self._lock:
+            self._tombstone(item_id)
+            if self.delta_size == len(self.delta_vectors):
+                grown = np.empty(
+                    (2 * len(self.delta_vectors), self.delta_vectors.shape[1]),
+                    dtype=np.float32,
+                )
+                grown[: self.delta_size] = self.delta_vectors[: self.delta_size]
+                self.delta_vectors = grown
+            self.delta_vectors[self.delta_size] = vector
+            self.delta_ids.append(item_id)
+            self.delta_types.append(item_type)
+            self.id_to_row[item_id] = self.base_size + self.delta_size
+            # Published last, so readers never see a half written row
+            self.delta_size += 1
+            self._record(("upsert", item_id, item_type, vector))
+
+    def remove(self, item_id: str) -> bool:
+        with self._lock:
+            removed = self._tombstone(item_id)
+            self._record(("remove", item_id, None, None))
+        return removed
+
+    def _tombstone(self, item_id: str) -> bool:
+        row = self.id_to_row.pop(item_id, None)
+        if row is None:
+            return False
+        self.tombstones.add(row)
+        self._tombstone_rows = np.fromiter(self.tombstones, dtype=np.intp)
+        return True
+
+    def replay(self, log: list[tuple[str, str, str | None, np.ndarray | None]]):
+        for op, item_id, item_type, vector in log:
+            if op == "upsert":
+                self.upsert(item_id, item_type, vector)
+            else:
+                self.remove(item_id)
+
+    def materialize(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        delta_size = self.delta_size
+        alive = np.ones(self.base_size + delta_size, dtype=bool)
+        alive[self._tombstone_rows] = False
+        base_alive = alive[: self.base_size]
+        delta_alive = alive[self.base_size :]
+        vectors = np.concatenate(
+            [self.vectors[base_alive], self.delta_vectors[:delta_size][delta_alive]]
+        )
+        ids = np.concatenate(
+            [
+                self.item_ids[base_alive],
+                np.asarray(self.delta_ids[:delta_size], dtype=str)[delta_alive],
+            ]
+        )
+        types = np.concatenate(
+            [
+                self.item_types[base_alive],
+                np.asarray(self.delta_types[:delta_size], dtype=str)[delta_alive],
+            ]
+        )
+        return vectors, ids, types
+
+    def top_k(
+        self,
+        query: np.ndarray,
+        k: int,
+        item_type: str | None = None,
+        exclude: list[int] | None = None,
+        nprobe: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        exclude_rows = np.concatenate(
+            [np.asarray(exclude or [], dtype=np.intp), self._tombstone_rows]
+        )
+        rows, scores = self._top_k_base(
+            query, k, item_type, exclude_rows[exclude_rows < self.base_size], nprobe
+        )
+        return self._merge_delta(query, k, item_type, exclude_rows, rows, scores)
+
+    def _merge_delta(
+        self,
+        query: np.ndarray,
+        k: int,
+        item_type: str | None,
+        exclude_rows: np.ndarray,
+        rows: np.ndarray,
+        scores: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        delta_size = self.delta_size
+        if delta_size == 0:
+            return rows, scores
+        query = self.scoring.normalize_query(query)
+        delta_scores = self.delta_vectors[:delta_size] @ query
+        delta_exclude = np.concatenate([exclude_rows, self._tombstone_rows])
+        delta_exclude = delta_exclude[delta_exclude >= self.base_size] - self.base_size
+        delta_scores[delta_exclude[delta_exclude < delta_size]] = -np.inf
+        if item_type is not None:
+            delta_types = np.asarray(self.delta_types[:delta_size], dtype=str)
+            delta_scores[delta_types != item_type] = -np.inf
+        candidates = np.concatenate(
+            [rows, np.arange(delta_size, dtype=np.intp) + self.base_size]
+        )
+        best, best_scores = top_k(np.concatenate([scores, delta_scores]), k)
+        return candidates[best], best_scores
+
+    def _top_k_base(
+        self,
+        query: np.ndarray,
+        k: int,
+        item_type: str | None,
+        exclude_rows: np.ndarray,
+        nprobe: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        rows = self.partition(item_type)
+        if nprobe is not None and self.ann is not None:
+            return self.ann.search(
+                self.vectors,
+                self.scoring.normalize_query(query),
+                k,
+                nprobe,
+                rows,
+                exclude_rows,
+            )
+        if self.quantized is not None:
+            return self._top_k_quantized(query, k, rows, exclude_rows)
+        local, scores = self.scoring.top_k(
+            query, k, rows, self._to_local(rows, exclude_rows)
+        )
+        return self._to_global(rows, local), scores
+
+    def _top_k_quantized(
+        self,
+        query: np.ndarray,
+        k: int,
+        rows: slice | np.ndarray | None,
+        exclude_rows: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        query = self.scoring.normalize_query(query)
+        local, _ = top_k(
+            self.quantized.score(query, rows),
+            max(k, self.rerank),
+            self._to_local(rows, exclude_rows),
+        )
+        # Sorted rows keep the gather from the memory mapped matrix sequential
+        candidates = np.sort(self._to_global(rows, local))
+        best, scores = top_k(np.asarray(self.vectors[candidates]) @ query, k)
+        return candidates[best], scores
+
+    def _to_local(
+        self, rows: slice | np.ndarray | None, global_rows: np.ndarray
+    ) -> np.ndarray:
+        # Positions inside a partition of the given base segment rows
+        if rows is None:
+            return global_rows
+        if isinstance(rows, slice):
+            local = global_rows - rows.start
+            return local[(local >= 0) & (local < rows.stop - rows.start)]
+        positions = np.searchsorted(rows, global_rows)
+        found = positions < len(rows)
+        found[found] = rows[positions[found]] == global_rows[found]
+        return positions[found]
+
+    def _to_global(
+        self, rows: slice | np.ndarray | None, local: np.ndarray
+    ) -> np.ndarray:
+        if rows is None:
+            return local
+        if isinstance(rows, slice):
+            return local + rows.start
+        return rows[local]
+
+    def top_k_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        item_type: str | None = None,
+        excludes: list[list[int]] | None = None,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        # Scores many profiles with one GEMM per chunk of queries; chunks are
+        # sized so the score matrix stays within BATCH_SCORES_BUDGET
+        excludes = excludes or [[] for _ in range(len(queries))]
+        rows = self.partition(item_type)
+        if rows is None:
+            n_rows = self.base_size
+        elif isinstance(rows, slice):
+            n_rows = rows.stop - rows.start
+        else:
+            n_rows = len(rows)
+        tombstones = self._tombstone_rows[self._tombstone_rows < self.base_size]
+        chunk_size = max(1, BATCH_SCORES_BUDGET // max(1, n_rows))
+        results: list[tuple[np.ndarray, np.ndarray]] = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start : start + chunk_size]
+            scores = self.scoring.score_batch(chunk, rows)
+            scores[self._to_local(rows, tombstones), :] = -np.inf
+            for column, exclude in enumerate(excludes[start : start + chunk_size]):
+                exclude_rows = np.asarray(exclude, dtype=np.intp)
+                local, column_scores = top_k(
+                    scores[:, column],
+                    k,
+                    self._to_local(rows, exclude_rows[exclude_rows < self.base_size]),
+                )
+                results.append((self._to_global(rows, local), column_scores))
+        return [
+            self._merge_delta(
+                query,
+                k,
+                item_type,
+                np.asarray(excludes[i], dtype=np.intp),
+                *results[i],
+            )
+            for i, query in enumerate(queries)
+        ]
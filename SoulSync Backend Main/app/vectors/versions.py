@@ -0,0 +1,50 @@
+import os
+import shutil
+import time
+
+# Versions kept on disk besides the one a path points at, so a reader that
+# resolved an older one just before a switch can still open its files
+KEEP_VERSIONS = int(os.getenv("VECTOR_KEEP_VERSIONS", "2"))
+
+
+# Builds write each version of a directory next to it, then switch a symlink
+# at the directory's path over to it. The switch is a rename, so readers
+# see either the old version or the new one, never a missing or half
+# written directory.
+def new_version(path: str) -> str:
+    version_path = f"{path}.v{time.time_ns()}"
+    os.makedirs(version_path)
+    return version_path
+
+
+def publish_version(path: str, version_path: str):
+    link_path = f"{version_path}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    # Relative, so the vector dir can be moved as a whole
+    os.symlink(os.path.basename(version_path), link_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # Written before versioning; a rename cannot replace a directory
+        shutil.rmtree(path)
+    os.replace(link_path, path)
+    prune_versions(path)
+
+
+def resolve_version(path: str) -> str:
+    # Loaders read every file from the resolved version, so a switch in the
+    # middle of a load cannot mix files of two versions
+    return os.path.realpath(path)
+
+
+def prune_versions(path: str, keep: int = KEEP_VERSIONS):
+    # Only versions older than the current one are removed; newer ones may
+    # still be being written by another build
+    parent, name = os.path.split(os.path.abspath(path))
+    current = os.path.basename(resolve_version(path))
+    older = sorted(
+        entry
+        for entry in os.listdir(parent)
+        if entry.startswith(f"{name}.v") and entry < current
+    )
+    for entry in older[: max(0, len(older) - keep)]:
+        shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import time
+
+import pymongo
+from dotenv import load_dotenv
+
+from app.vectors.cf import CF_DIR, build_cf
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the item-item collaborative filtering table"
+    )
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectors"))
+    parser.add_argument(
+        "-k", type=int, default=100, help="co-liked items kept per item"
+    )
+    parser.add_argument(
+        "--block-size", type=int, default=10_000, help="items multiplied per block"
+    )
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.environ["MONGODB_CONNECTION"])
+    collection = client[os.environ["MONGODB_DATABASE"]].get_collection("preferences")
+    start = time.perf_counter()
+    manifest = build_cf(
+        collection, os.path.join(args.vector_dir, CF_DIR), args.k, args.block_size
+    )
+    client.close()
+    print(
+        f"Built {manifest['n_pairs']} item pairs from {manifest['n_likes']} likes in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
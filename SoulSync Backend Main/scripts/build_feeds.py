@@ -0,0 +1,72 @@
+import argparse
+import os
+import time
+
+import pymongo
+from dotenv import load_dotenv
+
+from app.models.media_item import FeatureWeights, MediaItem, MediaItemType
+from app.models.preference import Preference
+from app.models.recommendation_feed import RecommendationFeed
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Materialise recommendation feeds for every user"
+    )
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectors"))
+    parser.add_argument(
+        "--size", type=int, default=100, help="recommendations stored per feed"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="users scored per batch"
+    )
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.environ["MONGODB_CONNECTION"])
+    db = client[os.environ["MONGODB_DATABASE"]]
+    media_item = MediaItem.getInstance()
+    media_item.init(
+        db, args.vector_dir, FeatureWeights(), serving_only=True, scoring_only=True
+    )
+    preference = Preference.getInstance()
+    preference.init(db)
+    feed = RecommendationFeed.getInstance()
+    feed.init(db)
+
+    start = time.perf_counter()
+    total_users = 0
+    user_ids: list[str] = []
+
+    def flush():
+        profiles_by_user = {
+            user_id: media_item.build_profile(preferences)
+            for user_id, preferences in preference.get_users_preferences(
+                user_ids
+            ).items()
+        }
+        for filter in MediaItemType:
+            feeds = media_item.get_batch_recommendations(
+                filter, profiles_by_user, args.size
+            )
+            feed.save_feeds(filter.value, feeds)
+
+    for user_id in preference.get_user_ids():
+        user_ids.append(user_id)
+        if len(user_ids) == args.batch_size:
+            flush()
+            total_users += len(user_ids)
+            user_ids = []
+            print(f"Processed: {total_users} users")
+    if user_ids:
+        flush()
+        total_users += len(user_ids)
+
+    client.close()
+    print(f"Built feeds for {total_users} users in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
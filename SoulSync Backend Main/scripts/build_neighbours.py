@@ -0,0 +1,43 @@
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app.vectors.artifact import load_artifact
+from app.vectors.build import ARTIFACT_DIR
+from app.vectors.neighbours import NEIGHBOURS_DIR, build_neighbours
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the nearest neighbours of every media item"
+    )
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectors"))
+    parser.add_argument("-k", type=int, default=50, help="neighbours stored per item")
+    parser.add_argument(
+        "--block-size", type=int, default=None, help="items scored per block"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="processes scoring blocks"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    artifact = load_artifact(os.path.join(args.vector_dir, ARTIFACT_DIR))
+    manifest = build_neighbours(
+        artifact,
+        os.path.join(args.vector_dir, NEIGHBOURS_DIR),
+        args.k,
+        args.block_size,
+        args.jobs,
+    )
+    print(
+        f"Built {manifest['k']} neighbours for {manifest['n_items']} items in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import time
+
+import pymongo
+from dotenv import load_dotenv
+
+from app.models.media_item import FeatureWeights, n_components, random_seed
+from app.vectors.build import build_vectors
+from app.vectors.quantize import MODES
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the media item vectors")
+    parser.add_argument("--vector-dir", default=os.getenv("VECTOR_DIR", "vectors"))
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="processes used to fit vectorizers"
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="re-read MongoDB and refit the vectorizers instead of reusing them",
+    )
+    parser.add_argument(
+        "--ann-lists",
+        type=int,
+        default=None,
+        help="build an IVF index with this many inverted lists",
+    )
+    parser.add_argument(
+        "--nprobe", type=int, default=8, help="lists probed when measuring recall"
+    )
+    parser.add_argument(
+        "--feature-blocks",
+        action="store_true",
+        help="also store per-feature blocks so /recommend can take custom weights",
+    )
+    parser.add_argument(
+        "--quantize",
+        choices=MODES,
+        default=None,
+        help="also store a compact copy of the vectors for the coarse scoring pass",
+    )
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.environ["MONGODB_CONNECTION"])
+    collection = client[os.environ["MONGODB_DATABASE"]].get_collection("mediaItems")
+    start = time.perf_counter()
+    manifest = build_vectors(
+        collection,
+        args.vector_dir,
+        FeatureWeights().to_dict(),
+        n_components,
+        random_seed,
+        reuse_features=not args.refit,
+        batch_size=args.batch_size,
+        n_jobs=args.jobs,
+        ann_lists=args.ann_lists,
+        ann_nprobe=args.nprobe,
+        feature_blocks=args.feature_blocks,
+        quantization=args.quantize,
+    )
+    client.close()
+    print(f"Built {manifest['n_items']} vectors in {time.perf_counter() - start:.1f}s")
+    if "ann" in manifest:
+        print(
+            f"ANN recall@10 {manifest['ann']['recall_at_10']:.3f} with {manifest['ann']['n_lists']} lists at nprobe {args.nprobe}"
+        )
+    if "quantization" in manifest:
+        quantization = manifest["quantization"]
+        print(
+            f"{quantization['mode']} vectors use {quantization['bytes'] / 2**20:.1f}MB instead of {quantization['full_bytes'] / 2**20:.1f}MB, recall@10 {quantization['recall_at_10']:.3f} after reranking {quantization['rerank']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import os
+import time
+
+import pymongo
+from dotenv import load_dotenv
+
+from app.models.preference import Preference
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recount likes and dislikes and repair the media item counters"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="repairs written per batch"
+    )
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.environ["MONGODB_CONNECTION"])
+    preference = Preference.getInstance()
+    preference.init(client[os.environ["MONGODB_DATABASE"]])
+    start = time.perf_counter()
+    repaired = preference.reconcile_counters(args.batch_size)
+    client.close()
+    print(f"Repaired {repaired} counters in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
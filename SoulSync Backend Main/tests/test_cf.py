@@ -0,0 +1,37 @@
+from collections import Counter
+
+import numpy as np
+
+from app.vectors.cf import CFModel
+
+
+def make_model() -> CFModel:
+    # a and b co-liked twice, b and c once
+    return CFModel(
+        {},
+        np.asarray(["a", "b", "c"]),
+        np.asarray([0, 1, 3, 4]),
+        np.asarray([1, 0, 2, 1], dtype=np.int32),
+        np.asarray([2, 2, 1, 1], dtype=np.float32),
+        np.asarray([2, 3, 1], dtype=np.float32),
+    )
+
+
+def test_score_without_likes_after_delta():
+    model = make_model()
+    model.update("d", ["a"], 1)
+    for liked_ids in ([], ["unknown"]):
+        ids, scores = model.score(liked_ids)
+        assert ids == []
+        assert len(scores) == 0
+
+
+def test_score_with_delta():
+    model = make_model()
+    model.update("d", ["a"], 1)
+    ids, scores = model.score(["d"])
+    assert ids == ["a"]
+    assert scores.dtype == np.float64
+    ids, scores = model.score(["a"])
+    assert set(ids) == {"b", "d"}
+    assert model.delta["a"] == Counter({"d": 1})
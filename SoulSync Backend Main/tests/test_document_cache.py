@@ -0,0 +1,41 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from app.utils.document_cache import DocumentCache
+
+
+class Doc(BaseModel):
+    value: int
+
+
+def test_read_racing_an_invalidate_is_not_cached():
+    cache: DocumentCache[Doc] = DocumentCache("doc", Doc, url="")
+    store = {"a": Doc(value=1)}
+
+    async def run():
+        loading = asyncio.Event()
+        invalidated = asyncio.Event()
+
+        async def slow_load(keys: list[str]) -> dict[str, Doc]:
+            found = {key: store[key] for key in keys}
+            loading.set()
+            await invalidated.wait()
+            return found
+
+        async def update():
+            await loading.wait()
+            store["a"] = Doc(value=2)
+            await cache.invalidate_async("a")
+            invalidated.set()
+
+        read, _ = await asyncio.gather(cache.get_many_async(["a"], slow_load), update())
+        assert read["a"].value == 1
+
+        async def load(keys: list[str]) -> dict[str, Doc]:
+            return {key: store[key] for key in keys}
+
+        assert (await cache.get_many_async(["a"], load))["a"].value == 2
+        assert cache.invalidated == {}
+
+    asyncio.run(run())
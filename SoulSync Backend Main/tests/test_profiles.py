@@ -0,0 +1,35 @@
+import numpy as np
+
+from app.vectors.profiles import DISLIKE, LIKE, ProfileVectors
+
+
+def test_remove_takes_back_the_added_vector():
+    profile = ProfileVectors(2)
+    profile.add("a", "book", LIKE, np.asarray([1.0, 0.0]))
+    profile.add("b", "book", LIKE, np.asarray([0.0, 1.0]))
+    # "a" was re-encoded since it was added
+    profile.remove("a")
+    np.testing.assert_allclose(profile.vector("book"), [0.0, 1.0])
+    profile.add("b", "book", DISLIKE, np.asarray([0.0, 5.0]))
+    assert profile.vector("book") is None
+    assert profile.rated == {"b": ("book", DISLIKE)}
+
+
+def test_copy_is_independent():
+    profile = ProfileVectors(2)
+    profile.add("a", "book", LIKE, np.asarray([1.0, 0.0]))
+    copy = profile.copy()
+    copy.add("b", "book", LIKE, np.asarray([0.0, 1.0]))
+    copy.remove("a")
+    np.testing.assert_allclose(profile.vector("book"), [1.0, 0.0])
+    assert list(profile.rated) == ["a"]
+
+
+def test_round_trip():
+    profile = ProfileVectors(2)
+    profile.add("a", "book", LIKE, np.asarray([1.0, 2.0]))
+    profile.add("b", "movie", DISLIKE, np.asarray([3.0, 4.0]))
+    loaded = ProfileVectors.from_dict(profile.to_dict())
+    loaded.remove("b")
+    assert loaded.rated == {"a": ("book", LIKE)}
+    np.testing.assert_allclose(loaded.vector(), [1.0, 2.0])
@@ -0,0 +1,39 @@
+import os
+
+from app.vectors.versions import new_version, publish_version, resolve_version
+
+
+def write(path: str, text: str):
+    version_path = new_version(path)
+    with open(os.path.join(version_path, "data"), "w") as f:
+        f.write(text)
+    publish_version(path, version_path)
+    return version_path
+
+
+def read(path: str) -> str:
+    with open(os.path.join(resolve_version(path), "data")) as f:
+        return f.read()
+
+
+def test_publish_switches_and_keeps_previous_versions(tmp_path):
+    path = str(tmp_path / "artifact")
+    first = write(path, "1")
+    assert read(path) == "1"
+    second = write(path, "2")
+    assert read(path) == "2"
+    # A reader that resolved the first version can still open it
+    assert os.path.exists(os.path.join(first, "data"))
+    write(path, "3")
+    write(path, "4")
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert read(path) == "4"
+
+
+def test_publish_replaces_an_unversioned_directory(tmp_path):
+    path = str(tmp_path / "artifact")
+    os.makedirs(path)
+    write(path, "1")
+    assert os.path.islink(path)
+    assert read(path) == "1"